@@ -0,0 +1,64 @@
+# bench/fake_session.py
+# Сессия Bot API без сети: запоминает вызовы и отвечает правдоподобными объектами
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram.client.session.base import BaseSession
+
+# Методы, которые в ответ возвращают сообщение
+_MESSAGE_METHODS = {"sendMessage", "sendPhoto", "editMessageText", "editMessageReplyMarkup"}
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    def _result(self, bot, method) -> Any:
+        name = method.__api_method__
+        if name == "getMe":
+            return {"id": bot.id, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if name not in _MESSAGE_METHODS:
+            return True
+
+        message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": getattr(method, "chat_id", None) or 0, "type": "private"},
+            "text": getattr(method, "text", None) or "",
+        }
+        if name == "sendPhoto":
+            message["photo"] = [{
+                "file_id": f"bench-photo-{message_id}",
+                "file_unique_id": f"bench-{message_id}",
+                "width": 1000, "height": 500,
+            }]
+        return message
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        # Разбираем ответ тем же путём, что и настоящая сессия
+        content = json.dumps({"ok": True, "result": self._result(bot, method)})
+        return self.check_response(bot, method, 200, content).result
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[Dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,69 @@
+# bench/fake_yandex.py
+# Локальная заглушка IAM и YandexGPT: настраиваемая задержка и доля ошибок
+import asyncio
+import random
+import re
+import time
+
+from aiohttp import web
+
+IAM_PATH = "/iam/v1/tokens"
+GPT_PATH = "/foundationModels/v1/completion"
+
+
+def _calories_for(text: str) -> int:
+    # Стабильное «правдоподобное» число для одного и того же блюда
+    return 50 + sum(text.encode()) % 600
+
+
+def create_app(latency: float, jitter: float, error_rate: float, throttle_rate: float) -> web.Application:
+    stats = {"iam": 0, "gpt": 0, "errors": 0, "throttled": 0}
+
+    async def iam(request: web.Request) -> web.Response:
+        stats["iam"] += 1
+        expires = time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime(time.time() + 12 * 3600))
+        return web.json_response({"iamToken": "bench-token", "expiresAt": expires})
+
+    async def completion(request: web.Request) -> web.Response:
+        stats["gpt"] += 1
+        body = await request.json()
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+
+        roll = random.random()
+        if roll < throttle_rate:
+            stats["throttled"] += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if roll < throttle_rate + error_rate:
+            stats["errors"] += 1
+            return web.Response(status=503, text="bench: injected error")
+
+        prompt = body["messages"][-1]["text"]
+        lines = prompt.splitlines()
+        if len(lines) > 1:
+            # Пакетный запрос: «1. борщ» -> одно число на строку
+            text = "\n".join(str(_calories_for(re.sub(r"^\d+\.\s*", "", line))) for line in lines)
+        else:
+            text = str(_calories_for(prompt))
+        return web.json_response({
+            "result": {
+                "alternatives": [{"message": {"role": "assistant", "text": text}, "status": "ALTERNATIVE_STATUS_FINAL"}],
+                "usage": {"inputTextTokens": str(len(prompt)), "completionTokens": "3", "totalTokens": str(len(prompt) + 3)},
+            }
+        })
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post(IAM_PATH, iam)
+    app.router.add_post(GPT_PATH, completion)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+def serve(port: int, latency: float, jitter: float, error_rate: float, throttle_rate: float) -> None:
+    # Запускается в отдельном процессе, чтобы не делить цикл событий с ботом
+    web.run_app(
+        create_app(latency, jitter, error_rate, throttle_rate),
+        host="127.0.0.1", port=port, print=None, access_log=None
+    )
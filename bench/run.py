@@ -0,0 +1,385 @@
+# bench/run.py
+# Нагрузочный прогон: синтетические Update прямо в Dispatcher из main.py.
+# Telegram — FakeSession, YandexGPT/IAM — локальная заглушка, база — отдельная локальная Postgres.
+#
+#   BENCH_DATABASE_URL=postgresql://bench@localhost/calofit_bench python -m bench.run --users 2000 --updates 20000
+#   python -m bench.run ... --save-baseline bench/baseline.json
+#   python -m bench.run ... --compare bench/baseline.json   # код возврата 1 при регрессии
+#
+# Базовый прогон в репозитории не лежит: абсолютные цифры зависят от машины и настроек Postgres.
+# Сохраняйте его на той же машине и с теми же параметрами, на коммите до изменения, затем сравнивайте.
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.append(".")
+
+FOODS = [
+    "борщ", "гречка", "овсянка на молоке", "куриная грудка", "рис отварной", "яблоко", "банан",
+    "творог 5%", "омлет из двух яиц", "салат цезарь", "пельмени", "макароны с сыром", "кефир",
+    "хлеб белый", "сырники", "плов", "котлета куриная", "картофельное пюре", "шоколад молочный",
+    "кофе с молоком", "апельсин", "греческий йогурт", "шаурма", "пицца маргарита", "суп куриный",
+]
+VARIANTS = ["домашний", "из столовой", "без соли", "с маслом", "по-деревенски", "на пару", "острый"]
+AMOUNTS = ["", " 100 г", " 200 г", " 250 г", " 2", " 300 мл", " 0,5 л"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="calofitbot load test")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64, help="обновлений в обработке одновременно")
+    parser.add_argument("--mix", default="food=70,report=10,graph=10,from_cache=10")
+    parser.add_argument("--novel-rate", type=float, default=0.1, help="доля блюд, которых ещё нет в кэше")
+    parser.add_argument("--gpt-latency", type=float, default=0.3)
+    parser.add_argument("--gpt-jitter", type=float, default=0.1)
+    parser.add_argument("--gpt-error-rate", type=float, default=0.01)
+    parser.add_argument("--gpt-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-reset", action="store_true", help="не очищать базу перед прогоном")
+    parser.add_argument("--save-baseline")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение при --compare")
+    return parser.parse_args()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _write_key_file(path: str) -> None:
+    # Настоящий RSA-ключ: клиент подписывает JWT так же, как в проде
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    with open(path, "w") as f:
+        json.dump({"id": "bench-key", "service_account_id": "bench-sa", "private_key": pem}, f)
+
+
+def configure_env(args, gpt_port: int, key_path: str) -> None:
+    dsn = os.environ.get("BENCH_DATABASE_URL")
+    if not dsn:
+        sys.exit("BENCH_DATABASE_URL is required: bench очищает таблицы, нужна отдельная база")
+    if dsn == os.environ.get("DATABASE_URL"):
+        sys.exit("BENCH_DATABASE_URL must differ from DATABASE_URL")
+    # Всё это читается при импорте модулей бота, поэтому задаём до import main
+    os.environ["DATABASE_URL"] = dsn
+    os.environ["YANDEX_GPT_URL"] = f"http://127.0.0.1:{gpt_port}/foundationModels/v1/completion"
+    os.environ["YANDEX_IAM_URL"] = f"http://127.0.0.1:{gpt_port}/iam/v1/tokens"
+    os.environ["YANDEX_KEY_FILE"] = key_path
+    os.environ.setdefault("CALOFITBOT_TOKEN", "123456789:bench-token-bench-token-bench-token")
+    os.environ["METRICS_PORT"] = ""
+
+
+async def prepare_db(reset: bool) -> None:
+    import asyncpg
+    from db.migrate import run_migrations
+
+    conn = await asyncpg.connect(dsn=os.environ["DATABASE_URL"])
+    try:
+        # Чистая база получает ту же схему, что и прод: db/schema.sql и все миграции по порядку
+        await run_migrations(conn)
+        if reset:
+            await conn.execute(
+                "TRUNCATE users, calories, user_profiles, calorie_cache, user_calorie_cache, "
+                "daily_totals, fsm_states RESTART IDENTITY CASCADE"
+            )
+    finally:
+        await conn.close()
+
+
+class UpdateFactory:
+    def __init__(self, rng: random.Random, users: int, bot):
+        self.rng = rng
+        # Update, привязанный к боту заранее, Dispatcher не пересоздаёт через JSON внутри замера
+        self.bot = bot
+        self.user_ids = [10 ** 12 + i for i in range(users)]
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, telegram_id: int) -> dict:
+        return {"id": telegram_id, "is_bot": False, "first_name": f"user{telegram_id % 100000}", "username": None}
+
+    def _message(self, telegram_id: int, text: str) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": self._user(telegram_id),
+            "text": text,
+        }
+
+    def _update(self, payload: dict):
+        from aiogram.types import Update
+        return Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+
+    def message(self, telegram_id: int, text: str):
+        return self._update({"message": self._message(telegram_id, text)})
+
+    def callback(self, telegram_id: int, data: str):
+        # Нажатие кнопки под сообщением бота с клавиатурой
+        message = self._message(telegram_id, "📆")
+        message.pop("from")
+        return self._update({
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": self._user(telegram_id),
+                "chat_instance": str(telegram_id),
+                "data": data,
+                "message": message,
+            },
+        })
+
+    def food_text(self, novel_rate: float) -> str:
+        rng = self.rng
+        parts = []
+        for _ in range(rng.choice((1, 1, 1, 2, 3))):
+            food = rng.choice(FOODS)
+            if rng.random() < novel_rate:
+                # Случайное слово, а не число: число разбор количества принял бы за граммы
+                suffix = "".join(rng.choice("абвгдеклмнопрстуя") for _ in range(6))
+                food = f"{food} {rng.choice(VARIANTS)} {suffix}"
+            parts.append(food + rng.choice(AMOUNTS))
+        return ", ".join(parts)
+
+    def seed_script(self, telegram_id: int) -> list:
+        # Профиль через /start и пара личных блюд через /add_cache — как у настоящего пользователя
+        rng = self.rng
+        script = [
+            self.message(telegram_id, "/start"),
+            self.message(telegram_id, rng.choice(["👦", "👧"])),
+            self.message(telegram_id, str(rng.randint(18, 70))),
+            self.message(telegram_id, str(rng.randint(150, 200))),
+            self.message(telegram_id, str(rng.randint(50, 120))),
+        ]
+        if rng.random() < 0.3:
+            for _ in range(2):
+                script += [
+                    self.message(telegram_id, "/add_cache"),
+                    self.message(telegram_id, f"{rng.choice(FOODS)} {rng.choice(VARIANTS)}"),
+                    self.message(telegram_id, str(rng.randint(100, 900))),
+                ]
+        return script
+
+    def workload_update(self, kind: str, novel_rate: float):
+        telegram_id = self.rng.choice(self.user_ids)
+        if kind == "food":
+            return self.message(telegram_id, self.food_text(novel_rate))
+        if kind == "report":
+            return self.callback(telegram_id, self.rng.choice(["report_range_7", "report_range_30"]))
+        if kind == "graph":
+            return self.message(telegram_id, "/graph")
+        if kind == "from_cache":
+            return self.message(telegram_id, "/from_cache")
+        raise ValueError(f"Unknown workload kind: {kind}")
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+async def feed_all(dp, bot, updates: list, concurrency: int, latencies=None) -> int:
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def feed(kind, update):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                failures += 1
+            if latencies is not None:
+                latencies[kind].append(time.perf_counter() - started)
+
+    await asyncio.gather(*(feed(kind, update) for kind, update in updates))
+    return failures
+
+
+async def feed_scripts(dp, bot, scripts: list, concurrency: int) -> None:
+    # Шаги одного пользователя строго по порядку, разные пользователи — параллельно
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(script):
+        async with semaphore:
+            for update in script:
+                await dp.feed_update(bot, update)
+
+    await asyncio.gather(*(run(script) for script in scripts))
+
+
+async def fetch_fake_stats(port: int) -> dict:
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/stats") as resp:
+            return await resp.json()
+
+
+async def run_bench(args, gpt_port: int) -> dict:
+    from aiogram import Bot
+    import main
+    from bench.fake_session import FakeSession
+    from monitoring.metrics import DB_QUERIES, DB_QUERY_CALLS
+
+    await prepare_db(reset=not args.no_reset)
+
+    session = FakeSession(latency=args.telegram_latency)
+    bot = Bot(token=os.environ["CALOFITBOT_TOKEN"], session=session)
+    dp = main.create_dispatcher()
+    await main.startup(run_background=False)
+
+    rng = random.Random(args.seed)
+    factory = UpdateFactory(rng, args.users, bot)
+    try:
+        print(f"▶️ Seeding {args.users} users (/start, /add_cache)")
+        await feed_scripts(dp, bot, [factory.seed_script(uid) for uid in factory.user_ids], args.concurrency)
+
+        mix = {}
+        for item in args.mix.split(","):
+            kind, weight = item.split("=")
+            mix[kind.strip()] = float(weight)
+        kinds = rng.choices(list(mix), weights=list(mix.values()), k=args.updates)
+        updates = [(kind, factory.workload_update(kind, args.novel_rate)) for kind in kinds]
+
+        print(f"▶️ Running {args.updates} updates, concurrency {args.concurrency}")
+        session.calls.clear()
+        queries_before = DB_QUERIES.total()
+        calls_before = DB_QUERY_CALLS.snapshot()
+        latencies = defaultdict(list)
+        started = time.perf_counter()
+        failures = await feed_all(dp, bot, updates, args.concurrency, latencies)
+        elapsed = time.perf_counter() - started
+        queries = DB_QUERIES.total() - queries_before
+        calls = {labels[0]: n - calls_before.get(labels, 0) for labels, n in DB_QUERY_CALLS.snapshot().items()}
+    finally:
+        await main.close_resources()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "params": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare")},
+        "updates_per_sec": round(args.updates / elapsed, 1),
+        "seconds": round(elapsed, 2),
+        "failures": failures,
+        "db_queries_per_update": round(queries / args.updates, 2),
+        # По именам из db/queries.py — какой запрос дал прирост db_queries_per_update
+        "db_query_calls_per_update": {
+            name: round(n / args.updates, 3) for name, n in sorted(calls.items(), key=lambda kv: -kv[1]) if n
+        },
+        "latency": summarize(all_latencies),
+        "latency_by_kind": {kind: summarize(values) for kind, values in sorted(latencies.items())},
+        "telegram_calls": dict(session.calls),
+        "fake_yandex": await fetch_fake_stats(gpt_port),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    # Хуже = задержка или запросы выросли, либо пропускная способность упала больше допуска
+    regressions = []
+
+    def check(name, current, base, higher_is_worse=True):
+        if not base:
+            return
+        change = (current - base) / base
+        worse = change > tolerance if higher_is_worse else -change > tolerance
+        mark = "❌" if worse else "  "
+        print(f"{mark} {name:40} {base:>10} -> {current:>10} ({change:+.0%})")
+        if worse:
+            regressions.append(name)
+
+    # Сравнивать можно только прогоны с одинаковой нагрузкой
+    params = {k: v for k, v in result["params"].items() if k != "tolerance"}
+    differ = sorted(k for k, v in params.items() if baseline.get("params", {}).get(k) != v)
+    if differ:
+        print(f"⚠️ Baseline was run with different parameters: {', '.join(differ)}")
+
+    check("updates_per_sec", result["updates_per_sec"], baseline["updates_per_sec"], higher_is_worse=False)
+    check("db_queries_per_update", result["db_queries_per_update"], baseline["db_queries_per_update"])
+    for kind, stats in result["latency_by_kind"].items():
+        base = baseline.get("latency_by_kind", {}).get(kind)
+        if base:
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                check(f"{kind}.{key}", stats[key], base[key])
+    return regressions
+
+
+def main() -> None:
+    args = parse_args()
+    if args.compare and not os.path.exists(args.compare):
+        # Проверяем до прогона, а не после нескольких минут нагрузки
+        sys.exit(f"❌ No baseline at {args.compare}: run with --save-baseline {args.compare} on the commit to compare against")
+    from bench.fake_yandex import serve
+
+    gpt_port = _free_port()
+    ctx = multiprocessing.get_context("spawn")
+    fake = ctx.Process(
+        target=serve,
+        args=(gpt_port, args.gpt_latency, args.gpt_jitter, args.gpt_error_rate, args.gpt_throttle_rate),
+        daemon=True,
+    )
+    fake.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", gpt_port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        key_path = os.path.join(tmp, "key.json")
+        _write_key_file(key_path)
+        configure_env(args, gpt_port, key_path)
+        try:
+            result = asyncio.run(run_bench(args, gpt_port))
+        finally:
+            fake.terminate()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✅ Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regressions over {args.tolerance:.0%}")
+            sys.exit(1)
+        print("✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
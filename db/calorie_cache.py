@@ -0,0 +1,165 @@
+# db/calorie_cache.py
+import os
+from typing import Optional
+
+from db import queries
+from db.database import SHARED_WORKERS, get_db_pool
+from db.fuzzy_index import FuzzyIndex, fuzzy_report
+from db.lru_cache import LRUCache
+from db.normalize import normalize_input
+from monitoring.metrics import register_collector
+
+GLOBAL_CACHE_SIZE = int(os.environ.get("CALORIE_CACHE_SIZE", "50000"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CALORIE_CACHE_USERS", "0" if SHARED_WORKERS else "5000"))
+CACHE_TTL = float(os.environ.get("CALORIE_CACHE_TTL", "3600"))
+# Отрицательные ответы храним недолго: блюдо могли добавить из другого процесса
+NEGATIVE_TTL = float(os.environ.get("CALORIE_CACHE_NEGATIVE_TTL", "300"))
+
+_MISS = object()
+
+# Глобальный кэш: нормализованный ввод -> калории (или _MISS)
+_global_cache = LRUCache(GLOBAL_CACHE_SIZE, CACHE_TTL)
+# Личные кэши: user_id -> ({нормализованный ввод: калории}, FuzzyIndex)
+_user_cache = LRUCache(USER_CACHE_SIZE, CACHE_TTL)
+# Приблизительный поиск по глобальному кэшу, пополняется при каждой записи; ограничен как и _global_cache
+_global_fuzzy = FuzzyIndex(GLOBAL_CACHE_SIZE)
+
+# Попадания по уровням: user, global, global_db, user_fuzzy, global_fuzzy; miss — не нашли нигде
+tier_stats = {"user": 0, "global": 0, "global_db": 0, "user_fuzzy": 0, "global_fuzzy": 0, "miss": 0}
+
+
+async def warm_calorie_cache():
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        rows = await queries.load_global_cache(conn, GLOBAL_CACHE_SIZE)
+    for row in rows:
+        _global_cache.set(row["normalized_key"], row["calories"])
+        _global_fuzzy.add(row["normalized_key"], row["calories"])
+    print(f"✅ Calorie cache warmed: {len(rows)} entries")
+
+
+async def _get_user_entries(user_id: int) -> tuple[dict, FuzzyIndex]:
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        rows = await queries.load_user_cache(conn, user_id)
+    entries = {r["normalized_key"]: r["calories"] for r in rows}
+    index = FuzzyIndex()
+    for key, calories in entries.items():
+        index.add(key, calories)
+    _user_cache.set(user_id, (entries, index))
+    return entries, index
+
+
+async def _lookup_exact_global(key: str) -> Optional[int]:
+    cached = _global_cache.get(key)
+    if cached is _MISS:
+        return None
+    if cached is not None:
+        tier_stats["global"] += 1
+        return cached
+
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        calories = await queries.fetch_global_calories(conn, key)
+    if calories is None:
+        _global_cache.set(key, _MISS, ttl=NEGATIVE_TTL)
+        return None
+    _global_cache.set(key, calories)
+    _global_fuzzy.add(key, calories)
+    tier_stats["global_db"] += 1
+    return calories
+
+
+async def _lookup_exact(user_id: int, key: str) -> tuple[Optional[int], FuzzyIndex]:
+    # Сначала точное совпадение в локальном кэше пользователя
+    entries, user_fuzzy = await _get_user_entries(user_id)
+    if key in entries:
+        tier_stats["user"] += 1
+        return entries[key], user_fuzzy
+
+    # Потом точное совпадение в глобальном кэше (память, затем база)
+    return await _lookup_exact_global(key), user_fuzzy
+
+
+async def lookup_exact(user_id: int, input_text: str) -> Optional[int]:
+    # Только точные совпадения, без приблизительного поиска
+    calories, _ = await _lookup_exact(user_id, normalize_input(input_text))
+    return calories
+
+
+async def lookup_calories(user_id: int, input_text: str) -> Optional[int]:
+    key = normalize_input(input_text)
+    calories, user_fuzzy = await _lookup_exact(user_id, key)
+    if calories is not None:
+        return calories
+
+    # Перед походом в GPT пробуем похожие записи: сначала личные, потом глобальные
+    calories = user_fuzzy.lookup(key)
+    if calories is not None:
+        tier_stats["user_fuzzy"] += 1
+        return calories
+    calories = _global_fuzzy.lookup(key)
+    if calories is not None:
+        tier_stats["global_fuzzy"] += 1
+        return calories
+
+    tier_stats["miss"] += 1
+    return None
+
+
+async def lookup_global(input_text: str) -> Optional[int]:
+    # Для фоновых задач: только глобальный кэш, без личного пользователя
+    key = normalize_input(input_text)
+    calories = await _lookup_exact_global(key)
+    if calories is not None:
+        return calories
+    calories = _global_fuzzy.lookup(key)
+    if calories is not None:
+        tier_stats["global_fuzzy"] += 1
+    return calories
+
+
+def remember_global(input_text: str, calories: int) -> None:
+    key = normalize_input(input_text)
+    _global_cache.set(key, calories)
+    _global_fuzzy.add(key, calories)
+
+
+def invalidate_user(user_id: int) -> None:
+    _user_cache.pop(user_id)
+
+
+def cache_stats() -> dict:
+    return {
+        "tiers": dict(tier_stats),
+        "global": _global_cache.stats(),
+        "user": _user_cache.stats(),
+        "fuzzy": fuzzy_report(),
+    }
+
+
+def _cache_metrics():
+    stats = cache_stats()
+    fuzzy = stats["fuzzy"]
+    return [
+        ("calofit_calorie_cache_lookups_total", "counter", "Поиск калорий: на каком уровне нашли (miss — нигде)",
+         [({"tier": tier}, count) for tier, count in tier_stats.items()]),
+        ("calofit_calorie_cache_entries", "gauge", "Записей в кэшах калорий в памяти",
+         [({"cache": "global"}, len(_global_cache)), ({"cache": "user"}, len(_user_cache))]),
+        ("calofit_calorie_cache_events_total", "counter", "LRU-кэши калорий: попадания, промахи, вытеснения, истечения",
+         [({"cache": cache, "event": event}, stats[cache][event])
+          for cache in ("global", "user") for event in ("hits", "misses", "evictions", "expirations")]),
+        # Доля попаданий и среднее время — для подбора правил приблизительного поиска
+        ("calofit_fuzzy_lookups_total", "counter", "Приблизительный поиск: те же слова, опечатка или промах",
+         [({"result": "exact_tokens"}, fuzzy["exact_token_hits"]),
+          ({"result": "typo"}, fuzzy["hits"] - fuzzy["exact_token_hits"]),
+          ({"result": "miss"}, fuzzy["lookups"] - fuzzy["hits"])]),
+        ("calofit_fuzzy_lookup_seconds_total", "counter", "Суммарное время приблизительного поиска",
+         [({}, fuzzy["total_seconds"])]),
+    ]
+
+register_collector(_cache_metrics)
@@ -0,0 +1,84 @@
+# db/calorie_log.py
+# Запись еды одним вызовом серверной функции: пользователь, лимит, вставка и сводка — за один round trip.
+from typing import NamedTuple, Optional
+
+from db import queries
+from db.database import get_db_pool, remember_user
+
+DAILY_LIMIT = 40
+WARNING_THRESHOLD = 35
+
+CREATE_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION log_calorie_entries(
+        p_telegram_id bigint,
+        p_username text,
+        p_first_name text,
+        p_last_name text,
+        p_inputs text[],
+        p_calories integer[],
+        p_limit integer
+    ) RETURNS TABLE (user_id integer, entry_count integer, accepted boolean)
+    LANGUAGE plpgsql AS $$
+    #variable_conflict use_column
+    DECLARE
+        v_user_id integer;
+        v_count integer;
+        v_n integer := cardinality(p_inputs);
+    BEGIN
+        SELECT u.id INTO v_user_id FROM users u WHERE u.telegram_id = p_telegram_id;
+        IF v_user_id IS NULL THEN
+            INSERT INTO users AS u (telegram_id, username, first_name, last_name)
+            VALUES (p_telegram_id, p_username, p_first_name, p_last_name)
+            ON CONFLICT (telegram_id) DO UPDATE SET username = EXCLUDED.username
+            RETURNING u.id INTO v_user_id;
+        END IF;
+
+        -- Блокировка строки сводки сериализует одновременные записи одного пользователя.
+        -- Одним upsert'ом, а не DO NOTHING + SELECT FOR UPDATE: между ними /del может удалить
+        -- опустевшую строку, и SELECT вернул бы NULL
+        INSERT INTO daily_totals AS d (user_id, day) VALUES (v_user_id, current_date)
+        ON CONFLICT ON CONSTRAINT daily_totals_pkey DO UPDATE SET entry_count = d.entry_count
+        RETURNING d.entry_count INTO v_count;
+
+        IF v_count + v_n > p_limit THEN
+            RETURN QUERY SELECT v_user_id, v_count, false;
+            RETURN;
+        END IF;
+
+        INSERT INTO calories (user_id, input, calories)
+        SELECT v_user_id, e.input, e.calories
+        FROM unnest(p_inputs, p_calories) AS e(input, calories);
+
+        UPDATE daily_totals d SET
+            total_kcal = d.total_kcal + COALESCE((SELECT SUM(c) FROM unnest(p_calories) AS c), 0),
+            entry_count = d.entry_count + v_n,
+            unknown_count = d.unknown_count + (SELECT COUNT(*) FROM unnest(p_calories) AS c WHERE c IS NULL)
+        WHERE d.user_id = v_user_id AND d.day = current_date;
+
+        RETURN QUERY SELECT v_user_id, v_count + v_n, true;
+    END;
+    $$
+"""
+
+
+class LogResult(NamedTuple):
+    user_id: int
+    entry_count: int  # записей за сегодня (после вставки, если она прошла)
+    accepted: bool
+
+    @property
+    def remaining(self) -> int:
+        return max(DAILY_LIMIT - self.entry_count, 0)
+
+
+async def log_entries(tg_user, entries: list[tuple[str, Optional[int]]]) -> LogResult:
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        row = await queries.log_calorie_entries(
+            conn, tg_user,
+            [item for item, _ in entries],
+            [calories for _, calories in entries],
+            DAILY_LIMIT,
+        )
+    remember_user(tg_user, row["user_id"])
+    return LogResult(row["user_id"], row["entry_count"], row["accepted"])
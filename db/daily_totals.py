@@ -0,0 +1,89 @@
+# db/daily_totals.py
+# Сводка по дням: daily_totals(user_id, day, total_kcal, entry_count, unknown_count).
+# Обновляется в той же транзакции, что и вставка/удаление в calories
+# (вставка — в функции log_calorie_entries, см. db/calorie_log.py; удаление — remove_daily_entry в db/queries.py).
+# Запуск: python -m db.daily_totals backfill | check
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+sys.path.append(".")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        user_id integer NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        day date NOT NULL,
+        total_kcal integer NOT NULL DEFAULT 0,
+        entry_count integer NOT NULL DEFAULT 0,
+        unknown_count integer NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+"""
+
+# Эталонный расчёт по сырым записям — для заполнения и проверки
+_AGGREGATE_SQL = """
+    SELECT user_id, created_at::date AS day,
+           COALESCE(SUM(calories), 0)::int AS total_kcal,
+           COUNT(*)::int AS entry_count,
+           COUNT(*) FILTER (WHERE calories IS NULL)::int AS unknown_count
+    FROM calories
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id, created_at::date
+"""
+
+
+async def backfill_daily_totals(conn) -> None:
+    async with conn.transaction():
+        # Блокируем запись в calories, чтобы сводка не разошлась с данными во время пересчёта
+        await conn.execute("LOCK TABLE calories IN SHARE MODE")
+        await conn.execute("DELETE FROM daily_totals")
+        status = await conn.execute(
+            f"INSERT INTO daily_totals (user_id, day, total_kcal, entry_count, unknown_count) {_AGGREGATE_SQL}"
+        )
+    print(f"  daily_totals: {status}")
+
+
+async def check_daily_totals(conn) -> list:
+    return await conn.fetch(f"""
+        SELECT COALESCE(a.user_id, d.user_id) AS user_id,
+               COALESCE(a.day, d.day) AS day,
+               a.total_kcal AS expected_kcal, d.total_kcal AS actual_kcal,
+               a.entry_count AS expected_count, d.entry_count AS actual_count,
+               a.unknown_count AS expected_unknown, d.unknown_count AS actual_unknown
+        FROM ({_AGGREGATE_SQL}) a
+        FULL OUTER JOIN daily_totals d ON d.user_id = a.user_id AND d.day = a.day
+        WHERE a.user_id IS NULL OR d.user_id IS NULL
+           OR a.total_kcal <> d.total_kcal
+           OR a.entry_count <> d.entry_count
+           OR a.unknown_count <> d.unknown_count
+        ORDER BY 1, 2
+    """)
+
+
+async def main(command: str) -> int:
+    conn = await asyncpg.connect(dsn=os.environ["DATABASE_URL"])
+    try:
+        if command == "backfill":
+            await backfill_daily_totals(conn)
+            return 0
+        if command == "check":
+            mismatches = await check_daily_totals(conn)
+            for m in mismatches:
+                print(f"❌ user {m['user_id']} {m['day']}: "
+                      f"kcal {m['actual_kcal']} != {m['expected_kcal']}, "
+                      f"count {m['actual_count']} != {m['expected_count']}, "
+                      f"unknown {m['actual_unknown']} != {m['expected_unknown']}")
+            if mismatches:
+                print(f"❌ {len(mismatches)} inconsistent days, run: python -m db.daily_totals backfill")
+                return 1
+            print("✅ daily_totals is consistent")
+            return 0
+        print("Usage: python -m db.daily_totals backfill | check")
+        return 2
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "")))
@@ -1,34 +1,163 @@
 # db/database.py
+import asyncio
 import os
+import sys
+import time
 import asyncpg
 
+from db import queries
+from db.lru_cache import LRUCache
+from monitoring.metrics import DB_ACQUIRE_WAIT, DB_QUERIES, register_collector
+from monitoring.tracing import span, is_tracing
+
+# Webhook с несколькими воркерами: обновления одного пользователя попадают в разные процессы,
+# и кэш пользователя в памяти одного из них устаревает после /del_all или правки в другом.
+# Тогда такие кэши по умолчанию выключены (размер 0), как и кэш FSM
+SHARED_WORKERS = os.environ.get("BOT_MODE", "polling") == "webhook" and int(os.environ.get("WEB_WORKERS", "1")) > 1
+USER_ID_CACHE_SIZE = int(os.environ.get("USER_ID_CACHE_SIZE", "0" if SHARED_WORKERS else "20000"))
+
+# Пул: у каждого webhook-воркера свой, поэтому минимум небольшой
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+# Запросы из db/queries.py готовятся один раз на соединение; 0 — без подготовки (pgbouncer в режиме transaction)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "100"))
+# Запрос дольше стольких секунд прерывается на стороне клиента
+DB_COMMAND_TIMEOUT = float(os.environ.get("DB_COMMAND_TIMEOUT", "10"))
+# Простаивающее соединение закрывается через столько секунд, 0 — никогда
+DB_MAX_INACTIVE_LIFETIME = float(os.environ.get("DB_MAX_INACTIVE_LIFETIME", "300"))
+# После стольких запросов соединение пересоздаётся
+DB_MAX_QUERIES = int(os.environ.get("DB_MAX_QUERIES", "50000"))
+# Параметры сессии каждого соединения: передаются при подключении, без лишних запросов
+DB_SERVER_SETTINGS = {
+    "application_name": os.environ.get("DB_APPLICATION_NAME", "calofitbot"),
+    # Запросы бота короткие: компиляция JIT для них дороже самого запроса
+    "jit": "off",
+}
+
 _db_pool = None
+# telegram_id -> (users.id, username, first_name, last_name)
+_user_ids = LRUCache(USER_ID_CACHE_SIZE)
+
+class _TimedAcquire:
+    # Как PoolAcquireContext: работает и через async with, и через await
+    def __init__(self, pool, timeout, caller=None):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn = None
+        self._span = span(f"db.{caller}") if caller else None
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        conn = await self._pool.acquire(timeout=self._timeout)
+        waited = time.perf_counter() - started
+        DB_ACQUIRE_WAIT.observe(waited)
+        if self._span is not None:
+            self._span.set(acquire_ms=round(waited * 1000, 1))
+        return conn
+
+    async def __aenter__(self):
+        if self._span is not None:
+            self._span.__enter__()
+        self._conn = await self._acquire()
+        return self._conn
+
+    async def __aexit__(self, *exc):
+        conn, self._conn = self._conn, None
+        try:
+            await self._pool.release(conn)
+        finally:
+            if self._span is not None:
+                self._span.__exit__(*exc)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+
+class InstrumentedPool:
+    """Пул asyncpg, который замеряет ожидание свободного соединения; остальное — как у пула."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def acquire(self, *, timeout=None):
+        # При трассировке интервал называется по функции, которая взяла соединение: db.get_or_create_user
+        caller = sys._getframe(1).f_code.co_name if is_tracing() else None
+        return _TimedAcquire(self._pool, timeout, caller)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+def _pool_metrics():
+    if _db_pool is None:
+        return []
+    size = _db_pool.get_size()
+    return [
+        ("calofit_db_pool_connections", "gauge", "Соединения пула: занятые и всего",
+         [({"state": "in_use"}, size - _db_pool.get_idle_size()), ({"state": "total"}, size)]),
+        ("calofit_db_pool_max_size", "gauge", "Максимальный размер пула", [({}, _db_pool.get_max_size())]),
+    ]
+
+register_collector(_pool_metrics)
+
+def _count_query(record) -> None:
+    DB_QUERIES.inc("error" if record.exception else "ok")
+
+async def _init_connection(conn) -> None:
+    # Выполняется один раз для каждого нового соединения пула.
+    # Считаем на нём все запросы, в том числе не из db/queries.py
+    conn.add_query_logger(_count_query)
 
 async def init_db():
     global _db_pool
-    _db_pool = await asyncpg.create_pool(dsn=os.environ["DATABASE_URL"])
-    print("✅ DB pool initialized")
+    pool = await asyncpg.create_pool(
+        dsn=os.environ["DATABASE_URL"],
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        max_queries=DB_MAX_QUERIES,
+        server_settings=DB_SERVER_SETTINGS,
+        init=_init_connection,
+    )
+    _db_pool = InstrumentedPool(pool)
+    print(f"✅ DB pool initialized ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections)")
+
+async def close_db(timeout: float = 10):
+    global _db_pool
+    if _db_pool is None:
+        return
+    try:
+        # close() ждёт, пока соединения вернут в пул; зависшие по истечении срока рвём
+        await asyncio.wait_for(_db_pool.close(), timeout)
+    except TimeoutError:
+        _db_pool.terminate()
+    _db_pool = None
+    print("✅ DB pool closed")
 
 def get_db_pool():
     if _db_pool is None:
         raise RuntimeError("DB pool is not initialized. Call init_db() first.")
     return _db_pool
 
+def _user_fields(user_obj) -> tuple:
+    return user_obj.username, user_obj.first_name, user_obj.last_name
+
+def remember_user(user_obj, user_id: int) -> None:
+    _user_ids.set(user_obj.id, (user_id, *_user_fields(user_obj)))
+
+def invalidate_user_id(telegram_id: int) -> None:
+    _user_ids.pop(telegram_id)
+
 async def get_or_create_user(user_obj):
+    # Обычный путь — без обращения к базе; при смене имени/username запись обновится upsert'ом
+    cached = _user_ids.get(user_obj.id)
+    if cached is not None and cached[1:] == _user_fields(user_obj):
+        return cached[0]
+
     db_pool = get_db_pool()
     async with db_pool.acquire() as conn:
-        user = await conn.fetchrow(
-            "SELECT id FROM users WHERE telegram_id = $1",
-            user_obj.id
-        )
-        if user:
-            return user["id"]
-
-        return await conn.fetchval(
-            "INSERT INTO users (telegram_id, username, first_name, last_name) "
-            "VALUES ($1, $2, $3, $4) RETURNING id",
-            user_obj.id,
-            user_obj.username,
-            user_obj.first_name,
-            user_obj.last_name,
-        )
+        user_id = await queries.upsert_user(conn, user_obj.id, *_user_fields(user_obj))
+    remember_user(user_obj, user_id)
+    return user_id
@@ -0,0 +1,64 @@
+# db/explain_check.py
+# Проверка планов: EXPLAIN каждого запроса из db/queries.py, ошибка, если запрос читает большую таблицу целиком.
+# Запуск: python -m db.explain_check   (код возврата 1, если нашёлся Seq Scan)
+#
+# Планы строятся с enable_seqscan = off: на маленькой базе Postgres честно выбирает Seq Scan,
+# а так он остаётся в плане только там, где подходящего индекса нет совсем.
+import asyncio
+import json
+import os
+import sys
+
+import asyncpg
+
+sys.path.append(".")
+
+from db.queries import QUERIES
+
+# Таблицы, которые растут вместе с числом пользователей
+LARGE_TABLES = {"users", "calories", "user_profiles", "calorie_cache", "user_calorie_cache", "daily_totals", "fsm_states"}
+
+
+def seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in LARGE_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", ()):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def explain(conn, sql: str, args: tuple) -> dict:
+    # EXPLAIN без ANALYZE ничего не выполняет, в том числе DELETE и UPDATE
+    raw = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+    return json.loads(raw)[0]["Plan"]
+
+
+async def check_queries(conn) -> list:
+    failures = []
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for query in QUERIES.values():
+            tables = seq_scans(await explain(conn, query.sql, query.example))
+            if tables and not query.seq_scan_ok:
+                failures.append((query.name, tables))
+                print(f"❌ {query.name}: Seq Scan on {', '.join(sorted(set(tables)))}")
+            else:
+                print(f"✅ {query.name}")
+    return failures
+
+
+async def main() -> int:
+    conn = await asyncpg.connect(dsn=os.environ["DATABASE_URL"])
+    try:
+        failures = await check_queries(conn)
+    finally:
+        await conn.close()
+    if failures:
+        print(f"❌ {len(failures)} queries scan large tables, add an index in db/migrate.py")
+        return 1
+    print(f"✅ {len(QUERIES)} queries use indexes")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,108 @@
+# db/fsm_storage.py
+# Состояния диалогов (/start, /add_cache) в Postgres: переживают рестарт и общие для всех процессов
+import json
+import os
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from db import queries
+from db.database import get_db_pool
+from db.lru_cache import LRUCache
+
+FSM_CACHE_SIZE = int(os.environ.get("FSM_CACHE_SIZE", "10000"))
+# Брошенный на полпути диалог через сутки считается завершённым
+FSM_STATE_TTL = int(os.environ.get("FSM_STATE_TTL", str(24 * 3600)))
+FSM_PURGE_INTERVAL = int(os.environ.get("FSM_PURGE_INTERVAL", "3600"))
+
+_KEEP = object()
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key        text PRIMARY KEY,
+    state      text,
+    data       jsonb NOT NULL DEFAULT '{}'::jsonb,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at);
+"""
+
+class PostgresStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_states с write-through кэшем в памяти.
+
+    cache_ttl=0 отключает кэш: так нужно, когда обновления одного пользователя
+    могут прийти в разные процессы (webhook с несколькими воркерами).
+    """
+
+    def __init__(self, cache_ttl: float = 600, state_ttl: int = FSM_STATE_TTL):
+        self.state_ttl = state_ttl
+        self.cache_ttl = min(cache_ttl, state_ttl)
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # key -> (state, data); запись «нет состояния» тоже кэшируем — это самый частый случай
+        self._cache = LRUCache(FSM_CACHE_SIZE, ttl=self.cache_ttl) if self.cache_ttl > 0 else None
+        self._last_purge = time.monotonic()
+
+    def _cached(self, key: str) -> Optional[tuple[Optional[str], Dict[str, Any]]]:
+        return self._cache.get(key) if self._cache is not None else None
+
+    async def _load(self, key: str) -> tuple[Optional[str], Dict[str, Any]]:
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        db_pool = get_db_pool()
+        async with db_pool.acquire() as conn:
+            row = await queries.fsm_get(conn, key, float(self.state_ttl))
+        record = (row["state"], json.loads(row["data"])) if row else (None, {})
+        if self._cache is not None:
+            self._cache.set(key, record)
+        return record
+
+    def _update_cache(self, key: str, state: Any = _KEEP, data: Any = _KEEP) -> None:
+        # Кэш обновляем только если в нём уже есть вторая половина записи, иначе сбрасываем ключ
+        if self._cache is None:
+            return
+        cached = self._cached(key)
+        if cached is None:
+            self._cache.pop(key)
+            return
+        self._cache.set(key, (cached[0] if state is _KEEP else state, cached[1] if data is _KEEP else data))
+
+    async def _write(self, write, key: str, value: Any) -> None:
+        db_pool = get_db_pool()
+        async with db_pool.acquire() as conn:
+            await write(conn, key, value, float(self.state_ttl))
+            if time.monotonic() - self._last_purge > FSM_PURGE_INTERVAL:
+                self._last_purge = time.monotonic()
+                await queries.fsm_purge(conn, float(self.state_ttl))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+        await self._write(queries.fsm_set_state, storage_key, state)
+        self._update_cache(storage_key, state=state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, got {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        await self._write(queries.fsm_set_data, storage_key, json.dumps(data, ensure_ascii=False))
+        self._update_cache(storage_key, data=data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    def stats(self) -> dict:
+        return self._cache.stats() if self._cache is not None else {}
+
+    async def close(self) -> None:
+        # Пул соединений общий с остальным ботом, закрывать его здесь не нужно
+        if self._cache is not None:
+            self._cache.clear()
@@ -0,0 +1,232 @@
+# db/fuzzy_index.py
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Optional
+
+# Слова короче этого сравниваются только точно: в коротких словах одна буква меняет смысл
+FUZZY_MIN_TOKEN_LENGTH = 5
+
+# Служебные слова, которые не меняют блюдо
+_STOPWORDS = {"и", "в", "во", "на", "из", "по", "для", "под"}
+# Модификаторы меняют блюдо на противоположное: «кофе с сахаром» и «кофе без сахара» — разные записи.
+# Такое слово привязывается к следующему: «без+сахар»
+_MODIFIERS = {"с": "с", "со": "с", "без": "без", "не": "не"}
+_ENDINGS = sorted(
+    ["ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими",
+     "ой", "ей", "ом", "ем", "ам", "ям", "ах", "ях", "ую", "юю",
+     "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий",
+     "а", "я", "у", "ю", "ы", "и", "е", "о", "ь"],
+    key=len, reverse=True
+)
+
+# Статистика для подбора правил: сколько искали, сколько нашли, сколько времени ушло
+fuzzy_stats = {"lookups": 0, "hits": 0, "exact_token_hits": 0, "total_seconds": 0.0}
+
+
+def _stem(token: str) -> str:
+    # Грубое отсечение окончаний: «курицей» и «курица» дают одну основу
+    if token.isdigit() or len(token) <= 4:
+        return token
+    for ending in _ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def fuzzy_tokens(normalized_key: str) -> list[str]:
+    tokens, modifier = [], None
+    for word in normalized_key.split():
+        if word in _MODIFIERS:
+            if modifier is not None:
+                tokens.append(modifier)
+            modifier = _MODIFIERS[word]
+            continue
+        if word in _STOPWORDS:
+            continue
+        stem = _stem(word)
+        tokens.append(f"{modifier}+{stem}" if modifier else stem)
+        modifier = None
+    if modifier is not None:
+        tokens.append(modifier)
+    return tokens
+
+
+def fuzzy_key(normalized_key: str) -> str:
+    # Порядок слов не важен: «овсянка на молоке с бананом» == «с бананом овсянка на молоке»
+    return " ".join(sorted(fuzzy_tokens(normalized_key)))
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    # Одна замена, вставка, удаление или перестановка соседних букв
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if i == len(a):
+        return True
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i:i + 2] == b[i:i + 2][::-1] and a[i + 2:] == b[i + 2:])
+    return a[i:] == b[i + 1:]
+
+
+def is_typo(a: str, b: str) -> bool:
+    """Одно и то же слово с опечаткой. Модификатор и числа должны совпадать точно."""
+    if a == b:
+        return True
+    mod_a, _, word_a = a.rpartition("+")
+    mod_b, _, word_b = b.rpartition("+")
+    if mod_a != mod_b or word_a.isdigit() or word_b.isdigit():
+        return False
+    if min(len(word_a), len(word_b)) < FUZZY_MIN_TOKEN_LENGTH:
+        return False
+    # Первая буква не в счёт опечаток: «вареный» и «жареный» — разные блюда
+    return word_a[0] == word_b[0] and _within_one_edit(word_a, word_b)
+
+
+def typo_distance(query: list[str], candidate: list[str]) -> Optional[int]:
+    """Сколько слов запроса совпало с кандидатом только с опечаткой; None — наборы слов разные."""
+    if len(query) != len(candidate):
+        return None
+    rest = Counter(candidate)
+    typos = []
+    for token in query:
+        if rest[token]:
+            rest[token] -= 1
+        else:
+            typos.append(token)
+    for token in typos:
+        match = next((c for c, n in rest.items() if n and is_typo(token, c)), None)
+        if match is None:
+            return None
+        rest[match] -= 1
+    return len(typos)
+
+
+def _shape(token: str) -> Optional[tuple]:
+    # Слова с опечаткой друг в друге имеют один модификатор, одну первую букву и длину ±1
+    modifier, _, word = token.rpartition("+")
+    if word.isdigit() or len(word) < FUZZY_MIN_TOKEN_LENGTH:
+        return None
+    return modifier, word[0], len(word)
+
+
+class FuzzyIndex:
+    """Приблизительный поиск по кэшу: ключ — отсортированные основы слов.
+
+    Попадание — только если наборы слов совпадают с точностью до опечатки в отдельных словах.
+    Кандидаты — пересечение ключей, где есть каждое слово запроса или его вариант с опечаткой;
+    варианты ищутся только среди слов той же формы (_shape), поэтому поиск не растёт с размером кэша.
+    maxsize ограничивает индекс как LRU.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self.maxsize = maxsize
+        self._values: "OrderedDict[str, Any]" = OrderedDict()
+        # слово -> ключи, в которых оно есть
+        self._by_token: dict[str, set[str]] = {}
+        # форма слова -> слова этой формы
+        self._by_shape: dict[tuple, set[str]] = {}
+
+    def add(self, normalized_key: str, value: Any) -> None:
+        key = fuzzy_key(normalized_key)
+        if not key:
+            return
+        if key not in self._values:
+            for token in set(key.split()):
+                if token not in self._by_token:
+                    self._by_token[token] = set()
+                    shape = _shape(token)
+                    if shape is not None:
+                        self._by_shape.setdefault(shape, set()).add(token)
+                self._by_token[token].add(key)
+        self._values[key] = value
+        self._values.move_to_end(key)
+        while self.maxsize is not None and len(self._values) > self.maxsize:
+            self._remove(next(iter(self._values)))
+
+    def _remove(self, key: str) -> None:
+        del self._values[key]
+        for token in set(key.split()):
+            keys = self._by_token[token]
+            keys.discard(key)
+            if keys:
+                continue
+            del self._by_token[token]
+            shape = _shape(token)
+            if shape is not None:
+                self._by_shape[shape].discard(token)
+                if not self._by_shape[shape]:
+                    del self._by_shape[shape]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _keys_with(self, token: str) -> set[str]:
+        # Ключи, где есть это слово или оно же с опечаткой
+        keys = self._by_token.get(token, set())
+        shape = _shape(token)
+        if shape is None:
+            return keys
+        modifier, first, length = shape
+        variants = [
+            other
+            for size in (length - 1, length, length + 1)
+            for other in self._by_shape.get((modifier, first, size), ())
+            if other != token and is_typo(token, other)
+        ]
+        if not variants:
+            return keys
+        return keys.union(*(self._by_token[other] for other in variants))
+
+    def lookup(self, normalized_key: str) -> Optional[Any]:
+        started = time.perf_counter()
+        fuzzy_stats["lookups"] += 1
+        try:
+            key = fuzzy_key(normalized_key)
+            if key in self._values:
+                fuzzy_stats["hits"] += 1
+                fuzzy_stats["exact_token_hits"] += 1
+                self._values.move_to_end(key)
+                return self._values[key]
+
+            tokens = key.split()
+            if not any(_shape(t) is not None for t in tokens):
+                return None
+            postings = []
+            for token in set(tokens):
+                keys = self._keys_with(token)
+                if not keys:
+                    return None
+                postings.append(keys)
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+
+            # Из подходящих — с наименьшим числом опечаток, при равенстве — первый по алфавиту
+            best_key, best_rank = None, None
+            for candidate in candidates:
+                typos = typo_distance(tokens, candidate.split())
+                if typos is None:
+                    continue
+                rank = (typos, candidate)
+                if best_rank is None or rank < best_rank:
+                    best_key, best_rank = candidate, rank
+
+            if best_key is None:
+                return None
+            fuzzy_stats["hits"] += 1
+            self._values.move_to_end(best_key)
+            return self._values[best_key]
+        finally:
+            fuzzy_stats["total_seconds"] += time.perf_counter() - started
+
+
+def fuzzy_report() -> dict:
+    lookups = fuzzy_stats["lookups"]
+    return {
+        **fuzzy_stats,
+        "hit_rate": fuzzy_stats["hits"] / lookups if lookups else 0.0,
+        "avg_ms": fuzzy_stats["total_seconds"] * 1000 / lookups if lookups else 0.0,
+    }
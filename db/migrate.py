@@ -0,0 +1,214 @@
+# db/migrate.py
+# Запуск: python -m db.migrate          — применить новые миграции
+#         python -m db.migrate status   — какие версии применены
+# Применённые версии записываются в schema_migrations, каждая миграция выполняется один раз.
+# Сами шаги идемпотентны: миграцию, упавшую посередине, можно безопасно запустить повторно.
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+sys.path.append(".")
+
+from db.normalize import normalize_input
+from db.daily_totals import CREATE_TABLE_SQL as DAILY_TOTALS_SQL, backfill_daily_totals
+from db.calorie_log import CREATE_FUNCTION_SQL as LOG_FUNCTION_SQL
+from db.fsm_storage import CREATE_TABLE_SQL as FSM_STATES_SQL
+
+BACKFILL_BATCH_SIZE = 1000
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+# Ключ advisory-блокировки: воркеры, запущенные одновременно, применяют миграции по очереди
+MIGRATION_LOCK_ID = 5_310_742
+
+SCHEMA_MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version integer PRIMARY KEY,
+        name text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+
+async def _backfill(conn, table: str, pk: str, pk_type: str):
+    total = 0
+    while True:
+        rows = await conn.fetch(
+            f"SELECT {pk} AS pk, input FROM {table} WHERE normalized_key IS NULL LIMIT $1",
+            BACKFILL_BATCH_SIZE
+        )
+        if not rows:
+            break
+        await conn.execute(
+            f"""UPDATE {table} t SET normalized_key = v.key
+                FROM (SELECT unnest($1::{pk_type}[]) AS pk,
+                             unnest($2::text[]) AS key) v
+                WHERE t.{pk} = v.pk""",
+            [r["pk"] for r in rows],
+            [normalize_input(r["input"]) for r in rows]
+        )
+        total += len(rows)
+    print(f"  {table}: backfilled {total} rows")
+
+
+async def migrate_base_schema(conn):
+    with open(SCHEMA_PATH) as f:
+        await conn.execute(f.read())
+
+
+async def migrate_normalized_key(conn):
+    await conn.execute("ALTER TABLE calorie_cache ADD COLUMN IF NOT EXISTS normalized_key text")
+    await conn.execute("ALTER TABLE user_calorie_cache ADD COLUMN IF NOT EXISTS normalized_key text")
+
+    # calorie_cache уникален по input, поэтому он и служит ключом для обновления
+    await _backfill(conn, "calorie_cache", "input", "text")
+    await _backfill(conn, "user_calorie_cache", "id", "int")
+
+    async with conn.transaction():
+        # «Борщ» и «борщ» раньше были разными строками — оставляем по одной
+        await conn.execute("""
+            DELETE FROM calorie_cache a
+            USING calorie_cache b
+            WHERE a.normalized_key = b.normalized_key AND a.ctid < b.ctid
+        """)
+        await conn.execute("""
+            DELETE FROM user_calorie_cache a
+            USING user_calorie_cache b
+            WHERE a.user_id = b.user_id
+              AND a.normalized_key = b.normalized_key
+              AND a.id < b.id
+        """)
+        await conn.execute("ALTER TABLE calorie_cache ALTER COLUMN normalized_key SET NOT NULL")
+        await conn.execute("ALTER TABLE user_calorie_cache ALTER COLUMN normalized_key SET NOT NULL")
+
+    # INCLUDE (calories) позволяет отвечать на поиск только по индексу
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_calorie_cache_normalized_key
+        ON calorie_cache (normalized_key) INCLUDE (calories)
+    """)
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_calorie_cache_user_key
+        ON user_calorie_cache (user_id, normalized_key) INCLUDE (calories)
+    """)
+
+
+async def migrate_unestimated_index(conn):
+    # Фоновая дооценка выбирает записи без калорий — держим для них маленький частичный индекс
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_calories_unestimated
+        ON calories (id) WHERE calories IS NULL
+    """)
+
+
+async def migrate_daily_totals(conn):
+    await conn.execute(DAILY_TOTALS_SQL)
+    # Пересчёт идемпотентен: при повторном запуске сводка просто строится заново
+    await backfill_daily_totals(conn)
+
+
+async def migrate_log_function(conn):
+    await conn.execute(LOG_FUNCTION_SQL)
+
+
+async def migrate_profiles_index(conn):
+    # Последний профиль и история профилей пользователя читаются по этому индексу
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_profiles_latest
+        ON user_profiles (user_id, recorded_at DESC)
+    """)
+
+
+async def migrate_fsm_states(conn):
+    await conn.execute(FSM_STATES_SQL)
+
+
+async def migrate_hot_query_indexes(conn):
+    # /del, отчёт по выбранным дням, график и каскадное удаление пользователя
+    # ищут записи по user_id и created_at
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_calories_user_created
+        ON calories (user_id, created_at DESC)
+    """)
+    # Лимит записей в день держит log_calorie_entries через daily_totals,
+    # а старый триггер считал COUNT(*) по calories на каждую вставленную строку
+    await conn.execute("DROP TRIGGER IF EXISTS trg_check_max_entries ON calories")
+    await conn.execute("DROP FUNCTION IF EXISTS check_max_entries_per_day()")
+    # Индекс по created_at::date был нужен только триггеру, новый индекс его заменяет
+    await conn.execute("DROP INDEX IF EXISTS idx_calories_user_date")
+
+
+# Номера версий не меняются и не переиспользуются: новая миграция — новый номер в конце списка
+MIGRATIONS = [
+    (1, "base_schema", migrate_base_schema),
+    (2, "normalized_key", migrate_normalized_key),
+    (3, "unestimated_index", migrate_unestimated_index),
+    (4, "daily_totals", migrate_daily_totals),
+    (5, "log_calorie_entries", migrate_log_function),
+    (6, "profiles_index", migrate_profiles_index),
+    (7, "fsm_states", migrate_fsm_states),
+    (8, "hot_query_indexes", migrate_hot_query_indexes),
+    # Та же функция: строка сводки берётся upsert'ом и не теряется при гонке с /del
+    (9, "log_calorie_entries_upsert", migrate_log_function),
+]
+
+
+async def applied_migrations(conn) -> dict:
+    rows = await conn.fetch("SELECT version, applied_at FROM schema_migrations")
+    return {r["version"]: r["applied_at"] for r in rows}
+
+
+async def run_migrations(conn):
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute(SCHEMA_MIGRATIONS_SQL)
+        applied = await applied_migrations(conn)
+        pending = [m for m in MIGRATIONS if m[0] not in applied]
+        if not pending:
+            print(f"✅ Schema is up to date (version {MIGRATIONS[-1][0]})")
+            return
+        for version, name, migration in pending:
+            print(f"▶️ Migration {version:04d}: {name}")
+            await migration(conn)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                version, name
+            )
+        print("✅ Migrations complete")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def migrate_on_startup():
+    # MIGRATE_ON_STARTUP=1: отдельное соединение, у пула command_timeout мал для пересчётов
+    conn = await asyncpg.connect(dsn=os.environ["DATABASE_URL"])
+    try:
+        await run_migrations(conn)
+    finally:
+        await conn.close()
+
+
+async def print_status(conn):
+    await conn.execute(SCHEMA_MIGRATIONS_SQL)
+    applied = await applied_migrations(conn)
+    for version, name, _ in MIGRATIONS:
+        applied_at = applied.get(version)
+        mark = f"✅ {applied_at:%Y-%m-%d %H:%M}" if applied_at else "⏳ pending"
+        print(f"{version:04d} {name:<22} {mark}")
+
+
+async def main(command: str) -> int:
+    conn = await asyncpg.connect(dsn=os.environ["DATABASE_URL"])
+    try:
+        if command == "up":
+            await run_migrations(conn)
+            return 0
+        if command == "status":
+            await print_status(conn)
+            return 0
+        print("Usage: python -m db.migrate [up | status]")
+        return 2
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "up")))
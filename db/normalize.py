@@ -0,0 +1,11 @@
+# db/normalize.py
+import re
+
+_PUNCT_RE = re.compile(r"[^\w\s]|_")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_input(text: str) -> str:
+    # Ключ для кэша (колонка normalized_key): без регистра, пунктуации, лишних пробелов, ё -> е
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT_RE.sub(" ", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
@@ -0,0 +1,79 @@
+# db/profiles.py
+import os
+from bisect import bisect_right
+from datetime import date, datetime
+from typing import NamedTuple, Optional
+
+from db import queries
+from db.database import SHARED_WORKERS, get_db_pool
+from db.lru_cache import LRUCache
+
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "0" if SHARED_WORKERS else "10000"))
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "3600"))
+
+
+def calc_bmr(gender: str, age: int, height_cm: float, weight_kg: float) -> float:
+    # Расчёт нормы по формуле Миффлина-Сан Жеора
+    bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age
+    if gender == "male":
+        return bmr + 5
+    if gender == "female":
+        return bmr - 161
+    return bmr  # без корректировки
+
+
+class Profile(NamedTuple):
+    gender: str
+    age: int
+    height_cm: int
+    weight_kg: float
+    recorded_at: datetime
+    bmr: float
+
+
+# user_id -> история профилей по возрастанию recorded_at (пустой список — профиля нет)
+_histories = LRUCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+
+def _to_profile(row) -> Profile:
+    return Profile(
+        row["gender"], row["age"], row["height_cm"], row["weight_kg"], row["recorded_at"],
+        calc_bmr(row["gender"], row["age"], row["height_cm"], row["weight_kg"])
+    )
+
+
+async def get_profile_history(user_id: int) -> list[Profile]:
+    history = _histories.get(user_id)
+    if history is not None:
+        return history
+
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        rows = await queries.fetch_profile_history(conn, user_id)
+    history = [_to_profile(r) for r in rows]
+    _histories.set(user_id, history)
+    return history
+
+
+async def get_latest_profile(user_id: int) -> Optional[Profile]:
+    history = await get_profile_history(user_id)
+    return history[-1] if history else None
+
+
+def norm_for_day(history: list[Profile], day: date) -> Optional[float]:
+    # Норма на день — по последнему профилю, записанному до конца этого дня
+    if not history:
+        return None
+    idx = bisect_right([p.recorded_at.date() for p in history], day)
+    return history[max(idx - 1, 0)].bmr
+
+
+async def add_profile(user_id: int, gender: str, age: int, height_cm: int, weight_kg: float) -> None:
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        await queries.add_profile(conn, user_id, gender, age, height_cm, weight_kg)
+    invalidate_profile(user_id)
+
+
+def invalidate_profile(user_id: int) -> None:
+    _histories.pop(user_id)
@@ -0,0 +1,401 @@
+# db/queries.py
+# Все запросы бота в одном месте: имя, SQL и пример параметров для python -m db.explain_check.
+# Функции принимают соединение — из пула или внутри транзакции вызывающего — и считаются
+# в метриках по имени запроса. Готовит их кэш операторов asyncpg: каждый текст разбирается
+# один раз на соединение, поэтому DB_STATEMENT_CACHE_SIZE должен вмещать все QUERIES.
+from datetime import date, timedelta
+from typing import NamedTuple, Optional
+
+from monitoring.middleware import count_query
+from monitoring.tracing import span
+
+
+class Query(NamedTuple):
+    name: str
+    sql: str
+    example: tuple           # параметры для EXPLAIN в db/explain_check.py
+    seq_scan_ok: bool = False  # полный проход здесь — часть задачи, а не пропущенный индекс
+
+
+QUERIES: dict[str, Query] = {}
+
+_DAY = date(2025, 1, 1)
+
+
+def _query(name: str, sql: str, example: tuple, seq_scan_ok: bool = False) -> Query:
+    if name in QUERIES:
+        raise ValueError(f"Query {name!r} is already registered")
+    query = QUERIES[name] = Query(name, sql, example, seq_scan_ok)
+    return query
+
+
+def _run(query: Query) -> span:
+    count_query(query.name)
+    return span(f"sql.{query.name}")
+
+
+async def _fetch(conn, query: Query, *args) -> list:
+    with _run(query):
+        return await conn.fetch(query.sql, *args)
+
+
+async def _fetchrow(conn, query: Query, *args):
+    with _run(query):
+        return await conn.fetchrow(query.sql, *args)
+
+
+async def _fetchval(conn, query: Query, *args):
+    with _run(query):
+        return await conn.fetchval(query.sql, *args)
+
+
+async def _execute(conn, query: Query, *args) -> str:
+    with _run(query):
+        return await conn.execute(query.sql, *args)
+
+
+# --- users ---
+
+UPSERT_USER = _query("upsert_user", """
+    INSERT INTO users (telegram_id, username, first_name, last_name)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = EXCLUDED.username, first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name
+    RETURNING id
+""", (1, "u", "f", "l"))
+
+DELETE_USER = _query("delete_user", "DELETE FROM users WHERE id = $1", (1,))
+
+# Внутри функции только поиск по первичным и уникальным ключам, см. db/calorie_log.py
+LOG_CALORIE_ENTRIES = _query(
+    "log_calorie_entries",
+    "SELECT user_id, entry_count, accepted FROM log_calorie_entries($1, $2, $3, $4, $5, $6, $7)",
+    (1, "u", "f", "l", ["борщ"], [100], 40)
+)
+
+
+async def upsert_user(conn, telegram_id: int, username: Optional[str],
+                      first_name: Optional[str], last_name: Optional[str]) -> int:
+    return await _fetchval(conn, UPSERT_USER, telegram_id, username, first_name, last_name)
+
+
+async def delete_user(conn, user_id: int) -> None:
+    await _execute(conn, DELETE_USER, user_id)
+
+
+async def log_calorie_entries(conn, tg_user, inputs: list[str], calories: list[Optional[int]], limit: int):
+    return await _fetchrow(
+        conn, LOG_CALORIE_ENTRIES,
+        tg_user.id, tg_user.username, tg_user.first_name, tg_user.last_name, inputs, calories, limit
+    )
+
+
+# --- calories ---
+
+DELETE_LAST_ENTRY = _query("delete_last_entry", """
+    DELETE FROM calories
+    WHERE id = (
+        SELECT id FROM calories
+        WHERE user_id = $1
+        ORDER BY created_at DESC
+        LIMIT 1
+    )
+    RETURNING input, calories, created_at
+""", (1,))
+
+# Все выбранные дни — одним запросом; итоги по дням и среднее считает база
+REPORT_ENTRIES = _query("report_entries", """
+    WITH entries AS (
+        SELECT input, calories, created_at, created_at::date AS day
+        FROM calories
+        WHERE user_id = $1
+          AND created_at >= $2
+          AND created_at < $3
+          AND created_at::date = ANY($4::date[])
+    ), days AS (
+        SELECT day, COALESCE(SUM(calories), 0) AS total
+        FROM entries
+        GROUP BY day
+    )
+    SELECT e.input, e.calories, e.created_at, e.day, d.total AS day_total,
+           (SELECT AVG(total) FROM days) AS avg_total
+    FROM entries e
+    JOIN days d USING (day)
+    ORDER BY e.created_at
+""", (1, _DAY, date(2025, 1, 8), [_DAY, date(2025, 1, 7)]))
+
+# Постранично по id (keyset): каждая страница — записи старше последней просмотренной
+UNESTIMATED_ENTRIES = _query("unestimated_entries", """
+    SELECT id, user_id, input FROM calories
+    WHERE calories IS NULL
+      AND created_at >= current_date - $1::int
+      AND id < $2
+    ORDER BY id DESC
+    LIMIT $3
+""", (7, 1000, 200))
+
+# Обновление записей и сводки по дням — одним атомарным запросом
+APPLY_ESTIMATES = _query("apply_estimates", """
+    WITH updated AS (
+        UPDATE calories c SET calories = v.calories
+        FROM unnest($1::int[], $2::int[]) AS v(id, calories)
+        WHERE c.id = v.id AND c.calories IS NULL
+        RETURNING c.user_id, c.created_at::date AS day, c.calories
+    )
+    UPDATE daily_totals d SET
+        total_kcal = d.total_kcal + u.total,
+        unknown_count = d.unknown_count - u.n
+    FROM (SELECT user_id, day, SUM(calories)::int AS total, COUNT(*)::int AS n
+          FROM updated GROUP BY user_id, day) u
+    WHERE d.user_id = u.user_id AND d.day = u.day
+""", ([1], [100]))
+
+
+async def delete_last_entry(conn, user_id: int):
+    return await _fetchrow(conn, DELETE_LAST_ENTRY, user_id)
+
+
+async def fetch_report_entries(conn, user_id: int, days: list[date]) -> list:
+    # Диапазон от первого до последнего дня — для индекса, days — какие дни из него нужны
+    return await _fetch(conn, REPORT_ENTRIES, user_id, days[0], days[-1] + timedelta(days=1), days)
+
+
+async def fetch_unestimated(conn, lookback_days: int, before_id: Optional[int], limit: int) -> list:
+    # before_id=None — с самой новой записи; calories.id — serial, больше 2**31 - 1 не бывает
+    return await _fetch(conn, UNESTIMATED_ENTRIES, lookback_days,
+                        2**31 - 1 if before_id is None else before_id, limit)
+
+
+async def apply_estimates(conn, ids: list[int], values: list[int]) -> None:
+    await _execute(conn, APPLY_ESTIMATES, ids, values)
+
+
+# --- daily_totals ---
+
+COUNT_LOGGED_DAYS = _query(
+    "count_logged_days",
+    "SELECT COUNT(*) FROM daily_totals WHERE user_id = $1 AND entry_count > 0",
+    (1,)
+)
+
+# Длинный период — из сводки daily_totals: одна строка на день
+DAY_TOTALS = _query("day_totals", """
+    SELECT day, total_kcal, entry_count, unknown_count,
+           AVG(total_kcal) OVER () AS avg_total
+    FROM daily_totals
+    WHERE user_id = $1
+      AND day BETWEEN $2 AND $3
+      AND entry_count > 0
+    ORDER BY day
+""", (1, _DAY, date(2025, 1, 30)))
+
+RECENT_TOTALS = _query("recent_totals", """
+    SELECT day AS date, total_kcal AS total
+    FROM daily_totals
+    WHERE user_id = $1
+      AND day >= CURRENT_DATE - $2::int
+      AND entry_count > 0
+    ORDER BY day
+""", (1, 30))
+
+REMOVE_DAILY_ENTRY = _query("remove_daily_entry", """
+    UPDATE daily_totals SET
+        total_kcal = total_kcal - $3,
+        entry_count = entry_count - 1,
+        unknown_count = unknown_count - $4
+    WHERE user_id = $1 AND day = $2
+""", (1, _DAY, 100, 0))
+
+DROP_EMPTY_DAY = _query(
+    "drop_empty_day",
+    "DELETE FROM daily_totals WHERE user_id = $1 AND day = $2 AND entry_count <= 0",
+    (1, _DAY)
+)
+
+
+async def count_logged_days(conn, user_id: int) -> int:
+    return await _fetchval(conn, COUNT_LOGGED_DAYS, user_id)
+
+
+async def fetch_day_totals(conn, user_id: int, start: date, end: date) -> list:
+    return await _fetch(conn, DAY_TOTALS, user_id, start, end)
+
+
+async def fetch_recent_totals(conn, user_id: int, days: int) -> list:
+    return await _fetch(conn, RECENT_TOTALS, user_id, days)
+
+
+async def remove_daily_entry(conn, user_id: int, day: date, calories: Optional[int]) -> None:
+    # Вызывается в транзакции удаления записи из calories
+    await _execute(conn, REMOVE_DAILY_ENTRY, user_id, day, calories or 0, 1 if calories is None else 0)
+    await _execute(conn, DROP_EMPTY_DAY, user_id, day)
+
+
+# --- calorie_cache ---
+
+# Прогрев при старте читает первые N строк целиком
+LOAD_GLOBAL_CACHE = _query(
+    "load_global_cache",
+    "SELECT normalized_key, calories FROM calorie_cache LIMIT $1",
+    (1000,), seq_scan_ok=True
+)
+
+GLOBAL_CALORIES = _query(
+    "global_calories",
+    "SELECT calories FROM calorie_cache WHERE normalized_key = $1",
+    ("борщ",)
+)
+
+UPSERT_GLOBAL_CALORIES = _query("upsert_global_calories", """
+    INSERT INTO calorie_cache (input, normalized_key, calories) VALUES ($1, $2, $3)
+    ON CONFLICT (normalized_key) DO UPDATE SET calories = EXCLUDED.calories
+""", ("Борщ", "борщ", 100))
+
+
+async def load_global_cache(conn, limit: int) -> list:
+    return await _fetch(conn, LOAD_GLOBAL_CACHE, limit)
+
+
+async def fetch_global_calories(conn, normalized_key: str) -> Optional[int]:
+    # calories в calorie_cache NOT NULL: None — значит, строки нет
+    return await _fetchval(conn, GLOBAL_CALORIES, normalized_key)
+
+
+async def upsert_global_calories(conn, input_text: str, normalized_key: str, calories: int) -> None:
+    await _execute(conn, UPSERT_GLOBAL_CALORIES, input_text, normalized_key, calories)
+
+
+# --- user_calorie_cache ---
+
+USER_CACHE_KEYS = _query(
+    "user_cache_keys",
+    "SELECT normalized_key, calories FROM user_calorie_cache WHERE user_id = $1",
+    (1,)
+)
+
+USER_CACHE_EXISTS = _query(
+    "user_cache_exists",
+    "SELECT EXISTS (SELECT 1 FROM user_calorie_cache WHERE user_id = $1 AND normalized_key = $2)",
+    (1, "борщ")
+)
+
+ADD_USER_CACHE_ENTRY = _query(
+    "add_user_cache_entry",
+    "INSERT INTO user_calorie_cache (user_id, input, normalized_key, calories) VALUES ($1, $2, $3, $4)",
+    (1, "Борщ", "борщ", 100)
+)
+
+LIST_USER_CACHE = _query(
+    "list_user_cache",
+    "SELECT id, input, calories FROM user_calorie_cache WHERE user_id = $1 ORDER BY id",
+    (1,)
+)
+
+USER_CACHE_ENTRY = _query(
+    "user_cache_entry",
+    "SELECT input, calories FROM user_calorie_cache WHERE id = $1 AND user_id = $2",
+    (1, 1)
+)
+
+DELETE_USER_CACHE_ENTRY = _query(
+    "delete_user_cache_entry",
+    "DELETE FROM user_calorie_cache WHERE id = $1 AND user_id = $2",
+    (1, 1)
+)
+
+
+async def load_user_cache(conn, user_id: int) -> list:
+    return await _fetch(conn, USER_CACHE_KEYS, user_id)
+
+
+async def user_cache_exists(conn, user_id: int, normalized_key: str) -> bool:
+    return await _fetchval(conn, USER_CACHE_EXISTS, user_id, normalized_key)
+
+
+async def add_user_cache_entry(conn, user_id: int, input_text: str, normalized_key: str, calories: int) -> None:
+    await _execute(conn, ADD_USER_CACHE_ENTRY, user_id, input_text, normalized_key, calories)
+
+
+async def list_user_cache(conn, user_id: int) -> list:
+    return await _fetch(conn, LIST_USER_CACHE, user_id)
+
+
+async def fetch_user_cache_entry(conn, user_id: int, entry_id: int):
+    return await _fetchrow(conn, USER_CACHE_ENTRY, entry_id, user_id)
+
+
+async def delete_user_cache_entry(conn, user_id: int, entry_id: int) -> bool:
+    return await _execute(conn, DELETE_USER_CACHE_ENTRY, entry_id, user_id) == "DELETE 1"
+
+
+# --- user_profiles ---
+
+PROFILE_HISTORY = _query("profile_history", """
+    SELECT gender, age, height_cm, weight_kg, recorded_at
+    FROM user_profiles
+    WHERE user_id = $1
+    ORDER BY recorded_at
+""", (1,))
+
+ADD_PROFILE = _query("add_profile", """
+    INSERT INTO user_profiles (user_id, gender, age, height_cm, weight_kg)
+    VALUES ($1, $2, $3, $4, $5)
+""", (1, "male", 30, 180, 80.0))
+
+
+async def fetch_profile_history(conn, user_id: int) -> list:
+    return await _fetch(conn, PROFILE_HISTORY, user_id)
+
+
+async def add_profile(conn, user_id: int, gender: str, age: int, height_cm: int, weight_kg: float) -> None:
+    await _execute(conn, ADD_PROFILE, user_id, gender, age, height_cm, weight_kg)
+
+
+# --- fsm_states ---
+
+FSM_GET = _query("fsm_get", """
+    SELECT state, data::text AS data FROM fsm_states
+    WHERE key = $1 AND updated_at > now() - make_interval(secs => $2)
+""", ("fsm:1:1:1:default", 86400.0))
+
+# Просроченная строка, которую ещё не удалили, не должна оживить старые state или data
+FSM_SET_STATE = _query("fsm_set_state", """
+    INSERT INTO fsm_states (key, state) VALUES ($1, $2)
+    ON CONFLICT (key) DO UPDATE SET
+        state = EXCLUDED.state,
+        data = CASE WHEN fsm_states.updated_at > now() - make_interval(secs => $3)
+                    THEN fsm_states.data ELSE '{}'::jsonb END,
+        updated_at = now()
+""", ("fsm:1:1:1:default", "Form:age", 86400.0))
+
+FSM_SET_DATA = _query("fsm_set_data", """
+    INSERT INTO fsm_states (key, data) VALUES ($1, $2::jsonb)
+    ON CONFLICT (key) DO UPDATE SET
+        data = EXCLUDED.data,
+        state = CASE WHEN fsm_states.updated_at > now() - make_interval(secs => $3)
+                     THEN fsm_states.state END,
+        updated_at = now()
+""", ("fsm:1:1:1:default", "{}", 86400.0))
+
+# Заодно убираем пустые строки, которые остаются после state.clear(); раз в FSM_PURGE_INTERVAL
+FSM_PURGE = _query("fsm_purge", """
+    DELETE FROM fsm_states
+    WHERE updated_at < now() - make_interval(secs => $1)
+       OR (state IS NULL AND data = '{}'::jsonb)
+""", (86400.0,), seq_scan_ok=True)
+
+
+async def fsm_get(conn, key: str, ttl: float):
+    return await _fetchrow(conn, FSM_GET, key, ttl)
+
+
+async def fsm_set_state(conn, key: str, state: Optional[str], ttl: float) -> None:
+    await _execute(conn, FSM_SET_STATE, key, state, ttl)
+
+
+async def fsm_set_data(conn, key: str, data_json: str, ttl: float) -> None:
+    await _execute(conn, FSM_SET_DATA, key, data_json, ttl)
+
+
+async def fsm_purge(conn, ttl: float) -> None:
+    await _execute(conn, FSM_PURGE, ttl)
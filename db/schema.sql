@@ -0,0 +1,43 @@
+-- db/schema.sql
+-- Миграция 0001: базовые таблицы, как в проде (db/db_schema_dump.sql) до остальных миграций.
+-- Всё через IF NOT EXISTS: на существующей базе это ничего не меняет.
+CREATE TABLE IF NOT EXISTS users (
+    id serial PRIMARY KEY,
+    telegram_id bigint NOT NULL UNIQUE,
+    username text,
+    first_name text,
+    last_name text,
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP,
+    gender text CHECK (gender IN ('male', 'female', 'other')),
+    age integer
+);
+
+CREATE TABLE IF NOT EXISTS calories (
+    id serial PRIMARY KEY,
+    user_id integer REFERENCES users(id) ON DELETE CASCADE,
+    input text NOT NULL,
+    calories integer,
+    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_profiles (
+    id serial PRIMARY KEY,
+    user_id integer REFERENCES users(id) ON DELETE CASCADE,
+    gender text CHECK (gender IN ('male', 'female', 'other')),
+    age integer CHECK (age BETWEEN 5 AND 120),
+    height_cm integer CHECK (height_cm BETWEEN 50 AND 250),
+    weight_kg real CHECK (weight_kg BETWEEN 20 AND 300),
+    recorded_at timestamp DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS calorie_cache (
+    input text PRIMARY KEY,
+    calories integer NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_calorie_cache (
+    id serial PRIMARY KEY,
+    user_id integer REFERENCES users(id) ON DELETE CASCADE,
+    input text NOT NULL,
+    calories integer NOT NULL
+);
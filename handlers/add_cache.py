@@ -3,7 +3,10 @@ from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
+from db import queries
 from db.database import get_or_create_user, get_db_pool
+from db.calorie_cache import invalidate_user
+from db.normalize import normalize_input
 from aiogram.types import ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
 
 router = Router()
@@ -56,23 +59,18 @@ async def input_calories(message: Message, state: FSMContext):
     data = await state.get_data()
     user_id = await get_or_create_user(message.from_user)
     input_text = data["input_text"]
+    normalized_key = normalize_input(input_text)
 
     db_pool = get_db_pool()
     async with db_pool.acquire() as conn:
-        exists = await conn.fetchval(
-            "SELECT 1 FROM user_calorie_cache WHERE user_id = $1 AND LOWER(input) = LOWER($2)",
-            user_id, input_text
-        )
-        if exists:
+        if await queries.user_cache_exists(conn, user_id, normalized_key):
             await message.answer("⚠️ Такая запись уже есть.", reply_markup=ReplyKeyboardRemove())
             await state.clear()
             return
 
         # Добавляем новую запись
-        await conn.execute(
-            "INSERT INTO user_calorie_cache (user_id, input, calories) VALUES ($1, $2, $3)",
-            user_id, input_text, calories
-        )
+        await queries.add_user_cache_entry(conn, user_id, input_text, normalized_key, calories)
+    invalidate_user(user_id)
 
     await state.clear()
     await message.answer("✅ Запись добавлена в локальный кэш.", reply_markup=ReplyKeyboardRemove())
@@ -3,7 +3,10 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from db.database import get_db_pool, get_or_create_user
+from db import queries
+from db.database import get_db_pool, get_or_create_user, invalidate_user_id
+from db.calorie_cache import invalidate_user
+from .graph_cache import invalidate_graph
 
 
 router = Router()
@@ -14,19 +17,15 @@ async def handle_delete_last_entry(message: Message):
     db_pool = get_db_pool()
 
     async with db_pool.acquire() as conn:
-        deleted_entry = await conn.fetchrow(
-            """DELETE FROM calories
-               WHERE id = (
-                   SELECT id FROM calories
-                   WHERE user_id = $1
-                   ORDER BY created_at DESC
-                   LIMIT 1
-               )
-               RETURNING input, calories, created_at""",
-            user_id
-        )
+        async with conn.transaction():
+            deleted_entry = await queries.delete_last_entry(conn, user_id)
+            if deleted_entry:
+                await queries.remove_daily_entry(
+                    conn, user_id, deleted_entry["created_at"].date(), deleted_entry["calories"]
+                )
 
     if deleted_entry:
+        invalidate_graph(user_id)
         entry_info = (
             f"✅ Удалена запись:\n"
             f"🍽 {deleted_entry['input']}\n"
@@ -56,7 +55,10 @@ async def confirm_delete(callback: CallbackQuery):
     db_pool = get_db_pool()
 
     async with db_pool.acquire() as conn:
-        await conn.execute("DELETE FROM users WHERE id = $1", user_id)
+        await queries.delete_user(conn, user_id)
+    invalidate_user_id(callback.from_user.id)
+    invalidate_user(user_id)
+    invalidate_graph(user_id)
     await callback.message.edit_text("🗑️ Все ваши данные полностью удалены!")
 
 @router.callback_query(lambda c: c.data == "cancel_delete")
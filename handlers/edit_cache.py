@@ -2,7 +2,9 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from db import queries
 from db.database import get_db_pool, get_or_create_user
+from db.calorie_cache import invalidate_user
 
 router = Router()
 
@@ -13,10 +15,7 @@ async def edit_cache_command(message: Message):
     db_pool = get_db_pool()
 
     async with db_pool.acquire() as conn:
-        records = await conn.fetch(
-            "SELECT id, input, calories FROM user_calorie_cache WHERE user_id = $1 ORDER BY id",
-            user_id
-        )
+        records = await queries.list_user_cache(conn, user_id)
 
     if not records:
         await message.answer("ℹ️ Ваш локальный кэш пуст.")
@@ -45,21 +44,16 @@ async def handle_cache_delete(callback: CallbackQuery):
     db_pool = get_db_pool()
 
     async with db_pool.acquire() as conn:
-        deleted = await conn.execute(
-            "DELETE FROM user_calorie_cache WHERE id = $1 AND user_id = $2",
-            record_id, user_id
-        )
+        deleted = await queries.delete_user_cache_entry(conn, user_id, record_id)
 
-        if deleted == "DELETE 1":
+        if deleted:
+            invalidate_user(user_id)
             text = "✅ Запись удалена."
         else:
             text = "⚠️ Не удалось удалить запись. Возможно, она уже удалена."
 
         # Повторно отправим список
-        records = await conn.fetch(
-            "SELECT id, input, calories FROM user_calorie_cache WHERE user_id = $1 ORDER BY id",
-            user_id
-        )
+        records = await queries.list_user_cache(conn, user_id)
 
     if not records:
         await callback.message.edit_text("🗑️ Все записи удалены.")
@@ -1,7 +1,9 @@
 from aiogram import Router, F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from db import queries
 from db.database import get_or_create_user, get_db_pool
-from datetime import datetime
+from db.calorie_log import log_entries, DAILY_LIMIT
+from .graph_cache import invalidate_graph
 
 router = Router()
 
@@ -23,10 +25,7 @@ async def cmd_from_cache(message: Message):
     db_pool = get_db_pool()
 
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch(
-            "SELECT id, input, calories FROM user_calorie_cache WHERE user_id = $1 ORDER BY id",
-            user_id
-        )
+        rows = await queries.list_user_cache(conn, user_id)
 
     if not rows:
         await message.answer("❌ У вас пока нет сохранённых блюд.")
@@ -42,19 +41,17 @@ async def handle_add_from_cache(callback: CallbackQuery):
     db_pool = get_db_pool()
 
     async with db_pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT input, calories FROM user_calorie_cache WHERE id = $1 AND user_id = $2",
-            cache_id, user_id
-        )
+        row = await queries.fetch_user_cache_entry(conn, user_id, cache_id)
 
-        if not row:
-            await callback.message.edit_text("⚠️ Запись не найдена.")
-            return
+    if not row:
+        await callback.message.edit_text("⚠️ Запись не найдена.")
+        return
 
-        await conn.execute(
-            "INSERT INTO calories (user_id, input, calories, created_at) VALUES ($1, $2, $3, $4)",
-            user_id, row["input"], row["calories"], datetime.now()
-        )
+    result = await log_entries(callback.from_user, [(row["input"], row["calories"])])
+    if not result.accepted:
+        await callback.message.edit_text(f"❌ Достигнут дневной лимит в {DAILY_LIMIT} записей")
+        return
+    invalidate_graph(user_id)
 
     await callback.message.edit_text(
         f"✅ Добавлено: *{row['input']}* — *{row['calories']} ккал*",
@@ -1,90 +1,60 @@
 from aiogram import Router, types
 from aiogram.filters import Command
 from aiogram.types.input_file import BufferedInputFile
-from db.database import get_db_pool
-from io import BytesIO
-import matplotlib.pyplot as plt
+from datetime import date
+from db import queries
+from db.database import get_db_pool, get_or_create_user
+from db.profiles import get_profile_history, norm_for_day
+from .graph_render import render_graph
+from .graph_cache import GraphKey, get_graph, is_fresh, put_graph, graph_cache_stats, totals_digest
 
 router = Router()
 
+# Сколько последних дней на графике
+GRAPH_DAYS = 30
+
 @router.message(Command("graph"))
 async def send_graph(message: types.Message):
-    user_tg_id = message.from_user.id
-    db_pool = get_db_pool()
-
-    async with db_pool.acquire() as conn:
-        # Получение user_id
-        user_row = await conn.fetchrow(
-            "SELECT id FROM users WHERE telegram_id = $1",
-            user_tg_id
-        )
-        if not user_row:
-            await message.answer("Пользователь не найден в базе.")
-            return
-        user_id = user_row["id"]
-
-        # Получение данных по калориям по датам
-        calorie_rows = await conn.fetch("""
-            SELECT DATE(created_at) AS date, SUM(calories) AS total
-            FROM calories
-            WHERE user_id = $1
-              AND created_at >= CURRENT_DATE - INTERVAL '30 days'
-            GROUP BY DATE(created_at)
-            ORDER BY DATE(created_at)
-        """, user_id)
-
-        if not calorie_rows:
-            await message.answer("Нет данных для построения графика.")
-            return
+    user_id = await get_or_create_user(message.from_user)
 
-        # Получение последнего профиля пользователя
-        profile_row = await conn.fetchrow("""
-            SELECT gender, age, height_cm, weight_kg
-            FROM user_profiles
-            WHERE user_id = $1
-            ORDER BY recorded_at DESC
-            LIMIT 1
-        """, user_id)
+    # Повторный /graph: отправляем уже загруженную в Telegram картинку
+    cached = get_graph(user_id)
+    if cached and is_fresh(cached):
+        graph_cache_stats["hits"] += 1
+        await message.answer_photo(cached.file_id)
+        return
 
-        if not profile_row:
-            await message.answer("Сначала введите данные с помощью команды /start.")
-            return
-
-        gender = profile_row["gender"]
-        age = profile_row["age"]
-        height = profile_row["height_cm"]
-        weight = profile_row["weight_kg"]
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        # Получение данных по калориям по датам; по ним же сверяем кэш
+        calorie_rows = await queries.fetch_recent_totals(conn, user_id, GRAPH_DAYS)
+    # История профилей: норма меняется вместе с записанным весом
+    profiles = await get_profile_history(user_id)
+
+    key = GraphKey(
+        user_id, totals_digest(calorie_rows), profiles[-1].recorded_at if profiles else None, date.today()
+    )
+    if cached and cached.key == key:
+        graph_cache_stats["verified_hits"] += 1
+        put_graph(key, cached.file_id)
+        await message.answer_photo(cached.file_id)
+        return
+    graph_cache_stats["misses"] += 1
+
+    if not calorie_rows:
+        await message.answer("Нет данных для построения графика.")
+        return
+    if not profiles:
+        await message.answer("Сначала введите данные с помощью команды /start.")
+        return
 
     # Подготовка данных
     dates = [row["date"].strftime("%Y-%m-%d") for row in calorie_rows]
     totals = [row["total"] for row in calorie_rows]
+    norm_calories = [norm_for_day(profiles, row["date"]) for row in calorie_rows]
 
-    # Расчёт нормы по формуле Миффлина-Сан Жеора
-    if gender == "male":
-        bmr = 10 * weight + 6.25 * height - 5 * age + 5
-    elif gender == "female":
-        bmr = 10 * weight + 6.25 * height - 5 * age - 161
-    else:
-        bmr = 10 * weight + 6.25 * height - 5 * age  # без корректировки
-
-    norm_calories = [bmr for _ in dates]
-
-    # Построение графика
-    plt.figure(figsize=(6, 3))
-    plt.plot(dates, totals, marker='o', color='blue', label='Факт. калории')
-    plt.plot(dates, norm_calories, linestyle='--', color='red', label='Норма калорий')
-    plt.title("Калории по дням")
-    plt.xlabel("Дата")
-    plt.ylabel("Калории")
-    plt.xticks(rotation=45)
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-
-    # Сохранение графика в буфер
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    # Построение графика в отдельном процессе
+    png = await render_graph({"dates": dates, "totals": totals, "norms": norm_calories})
 
-    await message.answer_photo(BufferedInputFile(buffer.read(), filename="calories_graph.png"))
+    sent = await message.answer_photo(BufferedInputFile(png, filename="calories_graph.png"))
+    put_graph(key, sent.photo[-1].file_id)
@@ -0,0 +1,64 @@
+# Кэш отправленных графиков: повторный /graph отвечает тем же file_id без запросов и рендера
+import os
+import time
+from datetime import date
+from typing import NamedTuple, Optional
+
+from db.database import SHARED_WORKERS
+from db.lru_cache import LRUCache
+from monitoring.metrics import register_collector
+
+GRAPH_CACHE_SIZE = int(os.environ.get("GRAPH_CACHE_SIZE", "2000"))
+# Как долго доверяем записи без сверки с базой (данные мог изменить другой процесс).
+# Несколько webhook-воркеров: сбрасывает запись только тот, кто изменил данные, поэтому сверяем всегда
+GRAPH_CACHE_VERIFY_TTL = float(os.environ.get("GRAPH_CACHE_VERIFY_TTL", "0" if SHARED_WORKERS else "300"))
+
+
+class GraphKey(NamedTuple):
+    user_id: int
+    totals_digest: int  # отпечаток итогов по дням, которые рисует график
+    last_profile_at: Optional[object]
+    day: date
+
+
+def totals_digest(rows) -> int:
+    # Меняется при любой правке итогов за окно графика: новая запись, /del, дооценка в другом процессе.
+    # hash, а не сами строки: в кэше до GRAPH_CACHE_SIZE ключей, сравниваются только в этом процессе
+    return hash(tuple((row["date"], row["total"]) for row in rows))
+
+
+class CachedGraph(NamedTuple):
+    key: GraphKey
+    file_id: str
+    verified_at: float
+
+
+_graph_cache = LRUCache(GRAPH_CACHE_SIZE)
+
+graph_cache_stats = {"hits": 0, "verified_hits": 0, "misses": 0, "invalidations": 0}
+
+
+def get_graph(user_id: int) -> Optional[CachedGraph]:
+    return _graph_cache.get(user_id)
+
+
+def is_fresh(entry: CachedGraph) -> bool:
+    return entry.key.day == date.today() and time.monotonic() - entry.verified_at < GRAPH_CACHE_VERIFY_TTL
+
+
+def put_graph(key: GraphKey, file_id: str) -> None:
+    _graph_cache.set(key.user_id, CachedGraph(key, file_id, time.monotonic()))
+
+
+def invalidate_graph(user_id: int) -> None:
+    if _graph_cache.pop(user_id) is not None:
+        graph_cache_stats["invalidations"] += 1
+
+
+def _graph_cache_metrics():
+    return [
+        ("calofit_graph_cache_total", "counter", "Кэш графиков: попадания, промахи, сбросы",
+         [({"result": name}, count) for name, count in graph_cache_stats.items()]),
+    ]
+
+register_collector(_graph_cache_metrics)
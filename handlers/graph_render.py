@@ -0,0 +1,78 @@
+# Рендер графика вынесен в отдельный процесс: matplotlib не блокирует цикл событий бота
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Optional
+
+GRAPH_WORKERS = int(os.environ.get("GRAPH_WORKERS", "1"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _warm_up_worker():
+    # Импорт matplotlib и построение кэша шрифтов — один раз при старте процесса
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(1, 1))
+    FigureCanvasAgg(fig)
+    fig.subplots().plot([0, 1], [0, 1], label="warm")
+    fig.savefig(BytesIO(), format="png")
+
+
+def render_calorie_graph(payload: dict) -> bytes:
+    """payload: {"dates": [str], "totals": [int], "norms": [float]} -> PNG."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dates = payload["dates"]
+
+    # Объектный API вместо pyplot: без глобального состояния
+    fig = Figure(figsize=(6, 3))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.plot(dates, payload["totals"], marker='o', color='blue', label='Факт. калории')
+    ax.plot(dates, payload["norms"], linestyle='--', color='red', label='Норма калорий')
+    ax.set_title("Калории по дням")
+    ax.set_xlabel("Дата")
+    ax.set_ylabel("Калории")
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.grid(True)
+    ax.legend()
+    fig.tight_layout()
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+async def init_graph_pool():
+    global _pool
+    # spawn, а не fork по умолчанию: пул поднимается после init_db() и init_gpt_client(), и fork
+    # унёс бы в дочерние процессы сокеты asyncpg, коннектор aiohttp и дескрипторы цикла событий
+    _pool = ProcessPoolExecutor(
+        max_workers=GRAPH_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_up_worker,
+    )
+    # Поднимаем все процессы заранее, чтобы первый /graph не ждал импорта matplotlib
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(_pool, _warm_up_worker) for _ in range(GRAPH_WORKERS)))
+    print("✅ Graph render pool initialized")
+
+
+async def render_graph(payload: dict) -> bytes:
+    if _pool is None:
+        raise RuntimeError("Graph pool is not initialized. Call init_graph_pool() first.")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, render_calorie_graph, payload)
+
+
+def close_graph_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
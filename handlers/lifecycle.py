@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждём начатые обработчики после SIGTERM; TimeoutStopSec в systemd должен быть больше
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "25"))
+# Файл появляется, когда процесс прогрет и принимает обновления, и удаляется при остановке
+READY_FILE = os.environ.get("READY_FILE", "")
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """Считает обновления, которые сейчас обрабатываются, чтобы при остановке их дождаться."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> int:
+        # Возвращает, сколько обработчиков так и не успело завершиться
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except TimeoutError:
+            logger.warning(f"Shutdown deadline reached with {self.in_flight} updates in flight")
+        else:
+            logger.info(f"Drained in-flight updates in {time.monotonic() - started:.1f}s")
+        return self.in_flight
+
+
+def sd_notify(state: str) -> None:
+    # Протокол sd_notify без зависимостей: датаграмма в сокет из NOTIFY_SOCKET (Type=notify в systemd)
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+    except OSError as e:
+        logger.warning(f"sd_notify failed: {e}")
+
+
+def mark_ready() -> None:
+    sd_notify("READY=1")
+    if READY_FILE:
+        with open(READY_FILE, "w") as f:
+            f.write(str(os.getpid()))
+    print("✅ Bot is ready")
+
+
+def mark_stopping() -> None:
+    sd_notify("STOPPING=1")
+    if READY_FILE:
+        try:
+            os.remove(READY_FILE)
+        except FileNotFoundError:
+            pass
@@ -1,41 +1,108 @@
 import re
+import os
+import asyncio
 import logging
 from typing import Optional
 from aiogram import Router
 from aiogram.types import Message
 
+from db import queries
 from db.database import get_or_create_user, get_db_pool
-from .yandex_gpt import query_yandex_gpt
+from db.calorie_cache import lookup_calories, lookup_exact, remember_global
+from db.calorie_log import log_entries, DAILY_LIMIT, WARNING_THRESHOLD
+from db.normalize import normalize_input
+from .quantity import parse_quantity, split_items
+from .single_flight import SingleFlight
+from .graph_cache import invalidate_graph
+from .yandex_gpt import query_yandex_gpt, GPTError, GPTUnavailable
+from monitoring.metrics import register_collector
+from monitoring.tracing import span
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+# Одинаковые блюда, запрошенные одновременно, уходят в GPT одним запросом
+gpt_flight = SingleFlight()
+
+def _flight_metrics():
+    stats = gpt_flight.stats()
+    return [
+        ("calofit_gpt_flight_calls_total", "counter", "Оценки через GPT: свой запрос или ожидание чужого такого же",
+         [({"result": "executed"}, stats["executed"]), ({"result": "coalesced"}, stats["coalesced"])]),
+        ("calofit_gpt_flight_inflight", "gauge", "Оценки через GPT в полёте", [({}, stats["inflight"])]),
+    ]
+
+register_collector(_flight_metrics)
+
+# Сколько позиций одного сообщения оцениваем параллельно
+ITEM_CONCURRENCY = int(os.environ.get("ITEM_CONCURRENCY", "4"))
+
+async def resolve_calories(user_id: int, input_text: str) -> Optional[int]:
+    # «гречка 250 г» считаем из калорийности «гречка 100 г», чтобы не спрашивать GPT про каждый вес
+    quantity = parse_quantity(input_text)
+
+    with span("cache.lookup") as lookup:
+        # Ввод целиком мог попасть в кэш как есть («гречка 250 г» из /add_cache) — тогда без пересчёта
+        calories = await lookup_exact(user_id, input_text) if quantity else None
+        if calories is not None:
+            quantity = None
+        lookup_text = quantity.base_text if quantity else input_text
+        if calories is None:
+            calories = await get_cached_calories(user_id, lookup_text)    # попытка получить из кэша
+        lookup.set(hit=calories is not None)
+    if calories is None:
+        # запрашиваем YandexGPT, если в кэше нет
+        calories = await gpt_flight.do(
+            normalize_input(lookup_text),
+            lambda: estimate_calories(lookup_text)
+        )
+
+    if calories is not None and quantity:
+        calories = quantity.scale(calories)
+    return calories
+
+async def resolve_items(user_id: int, items: list[str]) -> list[tuple[str, Optional[int]]]:
+    semaphore = asyncio.Semaphore(ITEM_CONCURRENCY)
+
+    async def resolve(item: str) -> Optional[int]:
+        if item.isdigit():
+            return int(item)
+        async with semaphore:
+            with span("item", text=item[:50]):
+                return await resolve_calories(user_id, item)
+
+    # Промахи кэша уходят в GPT параллельно: задержка ≈ одному запросу, а не сумме
+    results = await asyncio.gather(*(resolve(item) for item in items))
+    return list(zip(items, results))
+
+def format_entries(entries: list[tuple[str, Optional[int]]]) -> str:
+    if len(entries) == 1:
+        calories = entries[0][1]
+        response = f"✅ Записано: {calories if calories is not None else '?'} ккал"
+        if calories is None:
+            response += " (примерно)"
+        return response
+
+    total = sum(calories or 0 for _, calories in entries)
+    lines = [f"✅ Записано: {total} ккал"]
+    for item, calories in entries:
+        lines.append(f"🍽 {item} — {calories if calories is not None else '?'} ккал")
+    if any(calories is None for _, calories in entries):
+        lines.append("(примерно)")
+    return "\n".join(lines)
+
 @router.message()
 async def handle_text(message: Message) -> None:
     user_id = await get_or_create_user(message.from_user)
     input_text = message.text.strip()
 
     try:
-        if input_text.isdigit():
-            calories = int(input_text)
-        else:
-            calories = await get_cached_calories(user_id, input_text)    # попытка получить из кэша
-            if calories is None:
-                # запрашиваем YandexGPT, если в кэше нет
-                calories_str = await query_yandex_gpt(input_text)
-                logger.debug(f"Yandex GPT response: '{calories_str}'")
-
-                numbers = [int(m) for m in re.findall(r'\d+', calories_str)]
-                calories = numbers[0] if numbers else None
-
-                if calories is not None:
-                    await cache_calories(input_text, calories)
-
-        await log_calories(user_id, input_text, calories, message)
-        response = f"✅ Записано: {calories if calories is not None else '?'} ккал"
-        if calories is None:
-            response += " (примерно)"
-        await message.reply(response)
+        items = split_items(input_text) or [input_text]
+        entries = await resolve_items(user_id, items)
+
+        await log_calories(entries, message)
+        invalidate_graph(user_id)
+        await message.reply(format_entries(entries))
 
     except ValueError as e:
         await message.reply(str(e))
@@ -43,49 +110,43 @@ async def handle_text(message: Message) -> None:
         logger.exception(f"Error for user {user_id}")  # Логируем с traceback
         await message.reply("🔧 Произошла техническая ошибка")
 
-async def log_calories(user_id: int, input_text: str, calories: Optional[int], message: Message) -> None:
-    db_pool = get_db_pool()
-    async with db_pool.acquire() as conn:
-        today_count = await conn.fetchval(
-            "SELECT COUNT(*) FROM calories WHERE user_id = $1 AND created_at >= current_date",
-            user_id
-        )
+async def estimate_calories(input_text: str) -> Optional[int]:
+    try:
+        calories_str = await query_yandex_gpt(input_text)
+    except GPTUnavailable:
+        # Предохранитель разомкнут: пишем «?», запись с пустыми калориями дооценим позже
+        return None
+    except GPTError as e:
+        logger.warning(f"Yandex GPT failed for '{input_text}': {e}")
+        return None
+    logger.debug(f"Yandex GPT response: '{calories_str}'")
 
-        if 35 <= today_count < 40:
-            await message.reply(f"⚠️ Внимание: осталось {40 - today_count} из 40 записей на сегодня")
+    numbers = [int(m) for m in re.findall(r'\d+', calories_str)]
+    calories = numbers[0] if numbers else None
 
-        if today_count >= 40:
-            raise ValueError("❌ Достигнут дневной лимит в 40 записей")
+    # Пишем в кэш один раз, даже если ответа ждали несколько пользователей
+    if calories is not None:
+        await cache_calories(input_text, calories)
+    return calories
 
-        await conn.execute(
-            "INSERT INTO calories (user_id, input, calories) VALUES ($1, $2, $3)",
-            user_id, input_text, calories
-        )
+async def log_calories(entries: list[tuple[str, Optional[int]]], message: Message) -> None:
+    # Пользователь, проверка лимита и вставка — атомарно, одним вызовом функции в базе
+    result = await log_entries(message.from_user, entries)
+
+    if not result.accepted:
+        if result.entry_count >= DAILY_LIMIT:
+            raise ValueError(f"❌ Достигнут дневной лимит в {DAILY_LIMIT} записей")
+        raise ValueError(f"❌ Можно добавить ещё только {result.remaining} из {DAILY_LIMIT} записей на сегодня")
+
+    if WARNING_THRESHOLD <= result.entry_count < DAILY_LIMIT:
+        await message.reply(f"⚠️ Внимание: осталось {result.remaining} из {DAILY_LIMIT} записей на сегодня")
 
 async def get_cached_calories(user_id: int, input_text: str) -> Optional[int]:
-    db_pool = get_db_pool()
-    async with db_pool.acquire() as conn:
-        # Сначала смотрим локальный кэш пользователя
-        row = await conn.fetchrow(
-           # "SELECT calories FROM user_calorie_cache WHERE user_id = $1 AND input = $2",
-            "SELECT calories FROM user_calorie_cache WHERE user_id = $1 AND LOWER(input) = LOWER($2)",
-            user_id, input_text
-        )
-        if row:
-            return row["calories"]
-        # Потом глобальный кэш
-        row = await conn.fetchrow(
-            #"SELECT calories FROM calorie_cache WHERE input = $1",
-            "SELECT calories FROM calorie_cache WHERE LOWER(input) = LOWER($1)",
-            input_text
-        )
-        return row["calories"] if row else None
+    # Личный и глобальный кэш держим в памяти, в базу идём только при промахе
+    return await lookup_calories(user_id, input_text)
 
 async def cache_calories(input_text: str, calories: int) -> None:
     db_pool = get_db_pool()
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            """INSERT INTO calorie_cache (input, calories) VALUES ($1, $2)
-               ON CONFLICT (input) DO UPDATE SET calories = EXCLUDED.calories""",
-            input_text, calories
-        )
+        await queries.upsert_global_calories(conn, input_text, normalize_input(input_text), calories)
+    remember_global(input_text, calories)
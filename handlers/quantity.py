@@ -0,0 +1,113 @@
+# handlers/quantity.py
+# Разбор ввода: позиции сообщения («борщ, хлеб») и количество в позиции («гречка 250 г», «2 яйца»)
+import re
+from typing import NamedTuple, Optional
+
+# Единица измерения -> (базовая единица, множитель)
+_UNITS = {
+    "г": ("г", 1), "гр": ("г", 1), "грамм": ("г", 1), "грамма": ("г", 1), "граммов": ("г", 1),
+    "кг": ("г", 1000),
+    "мл": ("мл", 1),
+    "л": ("мл", 1000), "литр": ("мл", 1000), "литра": ("мл", 1000), "литров": ("мл", 1000),
+    "шт": ("шт", 1), "штук": ("шт", 1), "штуки": ("шт", 1), "штука": ("шт", 1),
+}
+# На какое количество храним калорийность в кэше: 100 г, 100 мл или 1 штука
+_BASE_AMOUNT = {"г": 100, "мл": 100, "шт": 1}
+# Целое число без единицы: маленькое — штуки («2 яйца»), большое — граммы («гречка 250»)
+_MAX_PIECES = 20
+# Штуками без единицы считаем только то, что едят штуками: «сахар 10» — не 10 порций сахара.
+# Начала основ, чтобы совпадали все падежи: «яйцо», «яйца», «яиц»
+_COUNTABLE = (
+    "яйц", "яиц", "банан", "яблок", "груш", "апельсин", "мандарин", "персик", "абрикос", "киви",
+    "слива", "сливы", "котлет", "сосиск", "сардельк", "пельмен", "вареник", "блин", "оладь", "оладий",
+    "сырник", "пирож", "булоч", "булк", "бутерброд", "тост", "круассан", "печенье", "печенек", "конфет",
+    "хлебц", "батончик", "маффин", "кекс", "суши", "ролл", "наггетс", "шаурм", "бургер",
+)
+# Слова после «с», «без», «и» — добавки, а не само блюдо: «салат с яйцом 2» — не штуки
+_HEAD_END = {"с", "со", "без", "и", "на"}
+
+_NUM = r"(?P<amount>\d+(?:[.,]\d+)?)"
+_UNIT = r"(?P<unit>кг|граммов|грамма|грамм|гр|г|мл|литра|литров|литр|л|штуки|штук|штука|шт)\.?"
+# Число без единицы считается количеством, только если отделено пробелом: «витамин b12» — название
+_QUANTITY_END_RE = re.compile(rf"^(?P<food>.*?[^\W\d_].*?)(?P<sep>\s*){_NUM}\s*(?:{_UNIT})?$", re.IGNORECASE)
+_QUANTITY_START_RE = re.compile(rf"^{_NUM}\s*(?:{_UNIT})?\s+(?P<food>.*[^\W\d_].*)$", re.IGNORECASE)
+# Позиция из одного количества с единицей («2 шт», «200 г») — продолжение предыдущей: «яйцо,2 шт»
+_ONLY_QUANTITY_RE = re.compile(rf"^{_NUM}\s*{_UNIT}$", re.IGNORECASE)
+
+_SEPARATORS = ";\n+"
+_BRACKETS = {"(": 1, "[": 1, "{": 1, ")": -1, "]": -1, "}": -1}
+
+
+class Quantity(NamedTuple):
+    food: str
+    amount: float
+    unit: str  # г, мл или шт
+
+    @property
+    def base_text(self) -> str:
+        # Под этим текстом калорийность базовой порции лежит в кэше и уходит в GPT
+        return f"{self.food} {_BASE_AMOUNT[self.unit]} {self.unit}"
+
+    def scale(self, base_calories: int) -> int:
+        return round(base_calories * self.amount / _BASE_AMOUNT[self.unit])
+
+
+def split_items(input_text: str) -> list[str]:
+    # «борщ, хлеб, компот» -> ["борщ", "хлеб", "компот"]. Разделители — ; + перевод строки и запятая,
+    # кроме десятичной («0,5 л») и запятых в скобках («салат (огурцы, помидоры)»)
+    parts, current, depth = [], [], 0
+    for i, char in enumerate(input_text):
+        depth = max(depth + _BRACKETS.get(char, 0), 0)
+        decimal = char == "," and input_text[i - 1:i].isdigit() and input_text[i + 1:i + 2].isdigit()
+        if depth == 0 and (char in _SEPARATORS or char == "," and not decimal):
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+
+    items = []
+    for part in (p.strip() for p in parts):
+        if not part:
+            continue
+        if items and _ONLY_QUANTITY_RE.match(part):
+            items[-1] = f"{items[-1]} {part}"
+        else:
+            items.append(part)
+    return items
+
+
+def parse_quantity(input_text: str) -> Optional[Quantity]:
+    text = input_text.strip()
+    match = _QUANTITY_END_RE.match(text) or _QUANTITY_START_RE.match(text)
+    if not match:
+        return None
+
+    raw_amount = match.group("amount")
+    amount = float(raw_amount.replace(",", "."))
+    if amount <= 0:
+        return None
+    food = match.group("food").strip(" ,.-:")
+    unit_raw = (match.group("unit") or "").lower()
+    if unit_raw:
+        unit, factor = _UNITS[unit_raw]
+    elif match.groupdict().get("sep") == "" or not raw_amount.isdigit():
+        # «витамин b12», «молоко 3.2» — число часть названия, а не количество
+        return None
+    elif amount > _MAX_PIECES:
+        unit, factor = "г", 1
+    elif _is_countable(food):
+        unit, factor = "шт", 1
+    else:
+        # «сахар 10», «сыр 15»: неясно, штуки это или что-то ещё — текст уходит в GPT как есть
+        return None
+    return Quantity(food, amount * factor, unit)
+
+
+def _is_countable(food: str) -> bool:
+    for word in food.lower().replace("ё", "е").split():
+        if word in _HEAD_END:
+            return False
+        if word.startswith(_COUNTABLE):
+            return True
+    return False
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from db.calorie_cache import lookup_global
+from db import queries
+from db.database import get_db_pool
+from db.lru_cache import LRUCache
+from db.normalize import normalize_input
+from .log_calories import cache_calories
+from .quantity import parse_quantity
+from .graph_cache import invalidate_graph
+from .yandex_gpt import query_yandex_gpt_batch, get_gpt_client, GPTError, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+REESTIMATE_INTERVAL = float(os.environ.get("REESTIMATE_INTERVAL", "60"))
+REESTIMATE_BATCH_SIZE = int(os.environ.get("REESTIMATE_BATCH_SIZE", "100"))
+REESTIMATE_GPT_BATCH = int(os.environ.get("REESTIMATE_GPT_BATCH", "10"))
+# Пауза между запросами к GPT, чтобы фон не конкурировал с пользователями
+REESTIMATE_GPT_DELAY = float(os.environ.get("REESTIMATE_GPT_DELAY", "5"))
+REESTIMATE_LOOKBACK_DAYS = int(os.environ.get("REESTIMATE_LOOKBACK_DAYS", "7"))
+
+# Блюда, которые GPT не смог оценить, какое-то время не трогаем
+_failed_keys = LRUCache(10000, ttl=6 * 3600)
+# Id последней просмотренной записи: следующий проход продолжает со старших записей,
+# иначе пропущенные блюда занимали бы каждую пачку и до старых записей очередь не доходила. None — с начала
+_cursor: Optional[int] = None
+
+stats = {"runs": 0, "rows_updated": 0, "gpt_batches": 0, "skipped_busy": 0}
+_stopping = asyncio.Event()
+
+
+def _gpt_is_busy() -> bool:
+    client = get_gpt_client()
+    return client.queued > 0 or client.in_flight > 0 or client.breaker.state == CircuitBreaker.OPEN
+
+
+async def _estimate_bases(bases: list[str]) -> dict[str, Optional[int]]:
+    # Сначала кэш, и только оставшееся — в GPT пачками
+    results = {}
+    misses = []
+    for base in bases:
+        calories = await lookup_global(base)
+        if calories is None:
+            misses.append(base)
+        results[base] = calories
+
+    for i in range(0, len(misses), REESTIMATE_GPT_BATCH):
+        if _gpt_is_busy():
+            stats["skipped_busy"] += 1
+            break
+        chunk = misses[i:i + REESTIMATE_GPT_BATCH]
+        try:
+            estimates = await query_yandex_gpt_batch(chunk)
+        except GPTError as e:
+            logger.warning(f"Re-estimation batch failed: {e}")
+            break
+        stats["gpt_batches"] += 1
+        for base, calories in zip(chunk, estimates):
+            results[base] = calories
+            if calories is None:
+                _failed_keys.set(normalize_input(base), True)
+            else:
+                await cache_calories(base, calories)
+        await asyncio.sleep(REESTIMATE_GPT_DELAY)
+    return results
+
+
+async def reestimate_once() -> int:
+    global _cursor
+    db_pool = get_db_pool()
+    async with db_pool.acquire() as conn:
+        rows = await queries.fetch_unestimated(conn, REESTIMATE_LOOKBACK_DAYS, _cursor, REESTIMATE_BATCH_SIZE)
+    # Неполная страница — окно пройдено до конца, следующий проход снова с самых новых записей
+    _cursor = rows[-1]["id"] if len(rows) == REESTIMATE_BATCH_SIZE else None
+    if not rows:
+        return 0
+
+    # Одинаковые блюда разных пользователей оцениваем один раз
+    groups: dict[str, list[int]] = {}
+    texts: dict[str, str] = {}
+    owners = {row["id"]: row["user_id"] for row in rows}
+    for row in rows:
+        key = normalize_input(row["input"])
+        if not key or _failed_keys.get(key):
+            continue
+        groups.setdefault(key, []).append(row["id"])
+        texts.setdefault(key, row["input"])
+
+    quantities = {key: parse_quantity(text) for key, text in texts.items()}
+    bases = {key: (q.base_text if q else texts[key]) for key, q in quantities.items()}
+    estimates = await _estimate_bases(sorted(set(bases.values())))
+
+    ids, values = [], []
+    for key, row_ids in groups.items():
+        calories = estimates.get(bases[key])
+        if calories is None:
+            continue
+        if quantities[key]:
+            calories = quantities[key].scale(calories)
+        ids.extend(row_ids)
+        values.extend([calories] * len(row_ids))
+
+    if not ids:
+        return 0
+    async with db_pool.acquire() as conn:
+        await queries.apply_estimates(conn, ids, values)
+    for row_id in ids:
+        invalidate_graph(owners[row_id])
+    stats["rows_updated"] += len(ids)
+    return len(ids)
+
+
+async def reestimate_worker():
+    while not _stopping.is_set():
+        try:
+            await asyncio.wait_for(_stopping.wait(), REESTIMATE_INTERVAL)
+            break
+        except TimeoutError:
+            pass
+        stats["runs"] += 1
+        try:
+            updated = await reestimate_once()
+            if updated:
+                logger.info(f"Re-estimated {updated} entries without calories")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Re-estimation run failed")
+
+
+def start_reestimate_worker() -> asyncio.Task:
+    _stopping.clear()
+    return asyncio.create_task(reestimate_worker())
+
+
+async def stop_reestimate_worker(task: asyncio.Task, timeout: float) -> None:
+    # Начатый проход дописывает свою пачку, новый уже не начинается; по истечении срока — отмена
+    _stopping.set()
+    try:
+        await asyncio.wait_for(task, timeout)
+    except (TimeoutError, asyncio.CancelledError):
+        logger.warning("Re-estimation run cancelled at shutdown")
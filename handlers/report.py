@@ -1,171 +1,235 @@
-from aiogram import Router
+from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery, User
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from datetime import datetime, timedelta
+from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
+from datetime import date, datetime, timedelta
+import re
+from html import escape, unescape
+from db import queries
 from db.database import get_db_pool, get_or_create_user
-import asyncio
+from db.profiles import get_profile_history, norm_for_day
 
 router = Router()
-user_selected_dates = {}
-user_days_map = {}
 
 MAX_BUTTONS = 16
 MIN_BUTTONS = 4
+# Период длиннее стольких дней показываем итогами по дням, а не каждой записью
+DETAILED_MAX_DAYS = 7
+MAX_SPAN_DAYS = 366
+TELEGRAM_MESSAGE_LIMIT = 4096
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+class ReportDays(CallbackData, prefix="rep"):
+    # Выбор дат целиком лежит в кнопке: на сервере ничего не храним.
+    # anchor — первый день клавиатуры (ordinal), дни идут назад от него; mask — выбранные дни битами
+    action: str  # t — переключить день, s — показать отчёт
+    anchor: int
+    count: int
+    mask: int
+
+
+def keyboard_days(anchor: int, count: int) -> list[date]:
+    first = date.fromordinal(anchor)
+    return [first - timedelta(days=i) for i in range(count)]
 
 @router.message(Command("report"))
 async def report_command(message: Message):
-    user_id = message.from_user.id
     today = datetime.now().date()
 
+    user_db_id = await get_or_create_user(message.from_user)
     db_pool = get_db_pool()
     async with db_pool.acquire() as conn:
-        user_db_id = await get_or_create_user(message.from_user)
-        rows = await conn.fetch(
-            "SELECT DISTINCT DATE(created_at) as day FROM calories WHERE user_id = $1 ORDER BY day DESC",
-            user_db_id
-        )
-        days_with_data = [r['day'] for r in rows]
+        total_days = await queries.count_logged_days(conn, user_db_id)
 
-    total_days = len(days_with_data)
     buttons_count = min(MAX_BUTTONS, max(MIN_BUTTONS, ((total_days + 3) // 4) * 4))
-    all_days = [today - timedelta(days=i) for i in range(buttons_count)]
-
-    user_selected_dates.pop(user_id, None)
-    user_days_map.pop(user_id, None)
-
-    user_selected_dates[user_id] = set()
-    user_days_map[user_id] = all_days
 
     # Отправляем начальное сообщение с клавиатурой
-    builder = build_date_keyboard(user_id, all_days)
-    await message.answer("📆 Выберите одну или несколько дат:", reply_markup=builder.as_markup())
+    builder = build_date_keyboard(today.toordinal(), buttons_count, 0)
+    await message.answer("📆 Выберите одну или несколько дат или период:", reply_markup=builder.as_markup())
 
-def build_date_keyboard(user_id: int, days: list[datetime.date]) -> InlineKeyboardBuilder:
+def build_date_keyboard(anchor: int, count: int, mask: int) -> InlineKeyboardBuilder:
     builder = InlineKeyboardBuilder()
-    selected = user_selected_dates.get(user_id, set())
 
-    for day in days:
-        iso = day.isoformat()
+    for i, day in enumerate(keyboard_days(anchor, count)):
         text = day.strftime("%d.%m")
-        if iso in selected:
+        if mask & (1 << i):
             text = f"✅ {text}"
-        builder.button(text=text, callback_data=f"select_{iso}")
+        builder.button(
+            text=text,
+            callback_data=ReportDays(action="t", anchor=anchor, count=count, mask=mask ^ (1 << i))
+        )
 
-    builder.button(text="📥 Показать отчёт", callback_data="report_show")
-    builder.adjust(4)
+    builder.button(text="🗓 Неделя", callback_data="report_range_7")
+    builder.button(text="🗓 Месяц", callback_data="report_range_30")
+    builder.button(text="✏️ Период", callback_data="report_span")
+    builder.button(
+        text="📥 Показать отчёт",
+        callback_data=ReportDays(action="s", anchor=anchor, count=count, mask=mask)
+    )
+    rows = [4] * ((count + 3) // 4)
+    builder.adjust(*rows, 3, 1)
     return builder
 
-@router.callback_query(lambda c: c.data and c.data.startswith("select_"))
-async def date_select_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    date_iso = callback.data.split("_")[1]
-    selected = user_selected_dates.setdefault(user_id, set())
+@router.callback_query(ReportDays.filter(F.action == "t"))
+async def date_select_callback(callback: CallbackQuery, callback_data: ReportDays):
+    # В кнопке уже лежит маска с переключённым днём — просто перерисовываем клавиатуру
+    count = min(callback_data.count, MAX_BUTTONS)
+    builder = build_date_keyboard(callback_data.anchor, count, callback_data.mask)
+    await callback.message.edit_reply_markup(reply_markup=builder.as_markup())
+    await callback.answer()
 
-    if date_iso in selected:
-        selected.remove(date_iso)
-    else:
-        selected.add(date_iso)
+@router.callback_query(ReportDays.filter(F.action == "s"))
+async def report_show_callback(callback: CallbackQuery, callback_data: ReportDays):
+    count = min(callback_data.count, MAX_BUTTONS)
+    days = keyboard_days(callback_data.anchor, count)
+    selected = sorted(day for i, day in enumerate(days) if callback_data.mask & (1 << i))
 
-    days = user_days_map.get(user_id)
-    if not days:
-        today = datetime.now().date()
-        days = [today - timedelta(days=i) for i in range(MAX_BUTTONS)]
+    if not selected:
+        await callback.answer("Выберите хотя бы одну дату")
+        return
 
-    builder = build_date_keyboard(user_id, days)
-    await callback.message.edit_reply_markup(reply_markup=builder.as_markup())
     await callback.answer()
+    await report_show(callback.message, callback.from_user, selected)
+
+@router.callback_query(lambda c: c.data and c.data.startswith("report_range_"))
+async def report_range_callback(callback: CallbackQuery):
+    days = int(callback.data.rsplit("_", 1)[1])
+    today = datetime.now().date()
+    await callback.answer()
+    dates = [today - timedelta(days=i) for i in reversed(range(days))]
+    await report_show(callback.message, callback.from_user, dates, summary=days > DETAILED_MAX_DAYS)
 
-    if len(selected) == 4:
-        await asyncio.sleep(0.1)
-        await report_show(callback.message, user_id, sorted(selected))
+@router.callback_query(lambda c: c.data == "report_span")
+async def report_span_callback(callback: CallbackQuery, state: FSMContext):
+    await state.update_data(report_span_start=None)
+    await callback.answer()
+    await callback.message.answer("📅 Выберите начальную дату:", reply_markup=await SimpleCalendar().start_calendar())
 
-@router.callback_query(lambda c: c.data == "report_show")
-async def report_show_callback(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    selected_dates = sorted(user_selected_dates.get(user_id, []))
+@router.callback_query(SimpleCalendarCallback.filter())
+async def report_span_calendar(callback: CallbackQuery, callback_data: SimpleCalendarCallback, state: FSMContext):
+    selected, picked = await SimpleCalendar().process_selection(callback, callback_data)
+    if not selected:
+        return
 
-    if not selected_dates:
-        await callback.answer("Выберите хотя бы одну дату")
+    data = await state.get_data()
+    start_iso = data.get("report_span_start")
+    if not start_iso:
+        await state.update_data(report_span_start=picked.date().isoformat())
+        await callback.message.answer(
+            f"Начало: {picked.strftime('%d.%m.%Y')}\n📅 Выберите конечную дату:",
+            reply_markup=await SimpleCalendar().start_calendar(year=picked.year, month=picked.month)
+        )
         return
 
-    await report_show(callback.message, user_id, selected_dates)
+    await state.update_data(report_span_start=None)
+    start, end = sorted([date.fromisoformat(start_iso), picked.date()])
+    if (end - start).days >= MAX_SPAN_DAYS:
+        await callback.message.answer(f"⚠️ Период не может быть длиннее {MAX_SPAN_DAYS} дней.")
+        return
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    await report_show(callback.message, callback.from_user, days, summary=len(days) > DETAILED_MAX_DAYS)
+
+def _split_long_line(line: str, limit: int) -> list[str]:
+    # Строка длиннее сообщения (очень длинный ввод): режем её текст, а не разметку —
+    # теги этой строки отбрасываем, сущности вроде &amp; экранируем заново и не разрываем
+    chunks, current, size = [], [], 0
+    for char in unescape(_TAG_RE.sub("", line)):
+        piece = escape(char)
+        if size + len(piece) > limit:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    # Режем по границам дней, а внутри слишком длинного дня — по строкам, чтобы не рвать HTML-теги
+    pages, current = [], ""
+    for block in text.split("\n\n"):
+        pieces = [block] if len(block) <= limit else block.split("\n")
+        for i, piece in enumerate(pieces):
+            sep = "\n\n" if i == 0 else "\n"
+            chunks = [piece] if len(piece) <= limit else _split_long_line(piece, limit)
+            for chunk in chunks:
+                if current and len(current) + len(sep) + len(chunk) > limit:
+                    pages.append(current)
+                    current = ""
+                current = f"{current}{sep}{chunk}" if current else chunk
+                sep = "\n"
+    if current:
+        pages.append(current)
+    return pages
+
+def format_detailed(days: list[date], rows: list, profiles: list) -> list[str]:
+    by_day = {}
+    for r in rows:
+        by_day.setdefault(r["day"], []).append(r)
 
-async def report_show(original_msg_with_keyboard: Message, user_id: int, selected_dates: list[str]):
-    db_pool = get_db_pool()
     final_report = []
+    for day in days:
+        day_rows = by_day.get(day)
+        if not day_rows:
+            final_report.append(f"📅 <b>{day.strftime('%d.%m.%Y')}</b>: записей нет.")
+            continue
+
+        lines = [f"📅 <b>{day.strftime('%d.%m.%Y')}</b>"]
+        for r in day_rows:
+            time_str = r['created_at'].strftime("%H:%M")
+            cal = r['calories'] if r['calories'] is not None else '?'
+            lines.append(f"⏰ {time_str} | 🍽 {escape(r['input'])} | 🔥 {cal} ккал")
+        lines.append(f"<i>Итого:</i> 🔥 {day_rows[0]['day_total']} ккал")
+        lines.append(f"<i>Норма:</i> 📊 ≈ {int(norm_for_day(profiles, day))} ккал\n")
+        final_report.append("\n".join(lines))
+
+    if len(by_day) > 1:
+        final_report.append(f"<i>В среднем за день с записями:</i> 🔥 {int(rows[0]['avg_total'])} ккал")
+    return final_report
+
+def format_summary(start: date, end: date, rows: list, profiles: list) -> list[str]:
+    lines = [f"📊 <b>{start.strftime('%d.%m.%Y')} — {end.strftime('%d.%m.%Y')}</b>"]
+    for r in rows:
+        unknown = f" (+{r['unknown_count']} ?)" if r["unknown_count"] else ""
+        lines.append(
+            f"📅 {r['day'].strftime('%d.%m')} | 🔥 {r['total_kcal']}{unknown} ккал"
+            f" | 📊 ≈ {int(norm_for_day(profiles, r['day']))}"
+        )
+    if rows:
+        lines.append(f"\n<i>Дней с записями:</i> {len(rows)}")
+        lines.append(f"<i>В среднем за день:</i> 🔥 {int(rows[0]['avg_total'])} ккал")
+    else:
+        lines.append("Записей нет.")
+    return ["\n".join(lines)]
+
+async def report_show(original_msg_with_keyboard: Message, tg_user: User, days: list[date], summary: bool = False):
+    user_db_id = await get_or_create_user(tg_user)
 
+    profiles = await get_profile_history(user_db_id)
+    if not profiles:
+        await original_msg_with_keyboard.answer("Сначала введите данные с помощью команды /start.")
+        return
+    if not days:
+        return
+
+    db_pool = get_db_pool()
     async with db_pool.acquire() as conn:
-        row_user = await conn.fetchrow("SELECT id FROM users WHERE telegram_id = $1", user_id)
-        if not row_user:
-            await original_msg_with_keyboard.answer("Пользователь не найден.")
-            return
-        user_db_id = row_user["id"]
-
-        profile = await conn.fetchrow("""
-            SELECT gender, age, height_cm, weight_kg
-            FROM user_profiles
-            WHERE user_id = $1
-            ORDER BY recorded_at DESC
-            LIMIT 1
-        """, user_db_id)
-
-        if not profile:
-            await original_msg_with_keyboard.answer("Сначала введите данные с помощью команды /start.")
-            return
-
-        gender = profile["gender"]
-        age = profile["age"]
-        height = profile["height_cm"]
-        weight = profile["weight_kg"]
-
-        if gender == "male":
-            bmr = 10 * weight + 6.25 * height - 5 * age + 5
-        elif gender == "female":
-            bmr = 10 * weight + 6.25 * height - 5 * age - 161
+        if summary:
+            rows = await queries.fetch_day_totals(conn, user_db_id, days[0], days[-1])
         else:
-            bmr = 10 * weight + 6.25 * height - 5 * age
-
-        for date_iso in selected_dates:
-            try:
-                date = datetime.fromisoformat(date_iso).date()
-            except ValueError:
-                continue
-
-            rows = await conn.fetch(
-                """
-                SELECT input, calories, created_at
-                FROM calories
-                WHERE user_id = $1
-                AND created_at >= $2
-                AND created_at < $3
-                ORDER BY created_at
-                """,
-                user_db_id, date, date + timedelta(days=1)
-            )
-
-            if not rows:
-                final_report.append(f"📅 <b>{date.strftime('%d.%m.%Y')}</b>: записей нет.")
-                continue
-
-            total = 0
-            lines = [f"📅 <b>{date.strftime('%d.%m.%Y')}</b>"]
-            for r in rows:
-                time_str = r['created_at'].strftime("%H:%M")
-                cal = r['calories'] if r['calories'] is not None else '?'
-                total += r['calories'] or 0
-                lines.append(f"⏰ {time_str} | 🍽 {r['input']} | 🔥 {cal} ккал")
-            lines.append(f"<i>Итого:</i> 🔥 {total} ккал")
-            lines.append(f"<i>Норма:</i> 📊 ≈ {int(bmr)} ккал\n")
-            final_report.append("\n".join(lines))
-
-    await original_msg_with_keyboard.answer("\n\n".join(final_report), parse_mode="HTML")
+            rows = await queries.fetch_report_entries(conn, user_db_id, days)
+    final_report = format_summary(days[0], days[-1], rows, profiles) if summary else format_detailed(days, rows, profiles)
+
+    # Длинный отчёт отправляем несколькими сообщениями
+    for page in split_message("\n\n".join(final_report)):
+        await original_msg_with_keyboard.answer(page, parse_mode="HTML")
 
     # Удаляем клавиатуру после отчёта
     try:
         await original_msg_with_keyboard.edit_reply_markup(reply_markup=None)
     except Exception:
         pass
-
-    user_selected_dates.pop(user_id, None)
-    user_days_map.pop(user_id, None)
@@ -0,0 +1,39 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один общий."""
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0        # всего обращений
+        self.executed = 0     # реально выполненных вызовов
+        self.coalesced = 0    # обращений, которые дождались чужого вызова
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не должна отменять общий вызов
+        return await asyncio.shield(task)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "inflight": self.inflight,
+        }
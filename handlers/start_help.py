@@ -3,7 +3,9 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from db.database import get_db_pool
+from db.database import get_or_create_user
+from db.profiles import add_profile
+from .graph_cache import invalidate_graph
 
 router = Router()
 
@@ -114,34 +116,10 @@ async def process_weight(message: Message, state: FSMContext):
     await state.update_data(weight_kg=weight)
     data = await state.get_data()
 
-    db_pool = get_db_pool()
-    async with db_pool.acquire() as conn:
-        user_id = await conn.fetchval("SELECT id FROM users WHERE telegram_id = $1", message.from_user.id)
-
-        if not user_id:
-            user_id = await conn.fetchval(
-                """
-                INSERT INTO users (telegram_id, username, first_name, last_name)
-                VALUES ($1, $2, $3, $4)
-                RETURNING id
-                """,
-                message.from_user.id,
-                message.from_user.username,
-                message.from_user.first_name,
-                message.from_user.last_name,
-            )
-
-        await conn.execute(
-            """
-            INSERT INTO user_profiles (user_id, gender, age, height_cm, weight_kg)
-            VALUES ($1, $2, $3, $4, $5)
-            """,
-            user_id,
-            data["gender"],
-            data["age"],
-            data["height_cm"],
-            data["weight_kg"]
-        )
+    user_id = await get_or_create_user(message.from_user)
+
+    await add_profile(user_id, data["gender"], data["age"], data["height_cm"], data["weight_kg"])
+    invalidate_graph(user_id)
 
     await message.answer(
         "Спасибо! Данные сохранены. Теперь я смогу строить точные графики и считать норму!",
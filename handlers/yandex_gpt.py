@@ -1,77 +1,416 @@
 import aiohttp
+import asyncio
 import os
+import random
+import re
 import time
 import json
+import logging
+from datetime import datetime
+from typing import Optional
 from cryptography.hazmat.primitives import serialization
 from jwt import encode as jwt_encode
 
+from monitoring.log import log_sampled
+from monitoring.metrics import GPT_LATENCY, register_collector
+from monitoring.tracing import span
+
+logger = logging.getLogger(__name__)
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # ..\calofitbot
-KEY_FILE_PATH = os.path.join(BASE_DIR, "key.json")
+KEY_FILE_PATH = os.environ.get("YANDEX_KEY_FILE", os.path.join(BASE_DIR, "key.json"))
 
-YANDEX_GPT_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+# Адреса можно подменить (например, на локальную заглушку из bench/)
+YANDEX_GPT_URL = os.environ.get("YANDEX_GPT_URL", "https://llm.api.cloud.yandex.net/foundationModels/v1/completion")
+YANDEX_IAM_URL = os.environ.get("YANDEX_IAM_URL", "https://iam.api.cloud.yandex.net/iam/v1/tokens")
 FOLDER_ID = "b1gjo1fm56glmpd0hs5r"
 SYSTEM_PROMPT = (
     "Ты помощник по питанию. Пользователь пишет название блюда или продукта, а ты отвечаешь только числом — сколько в нём примерно килокалорий. Никаких слов, только число. Если указывается готовая еда или блюдо то стоит считать не за 100грамм, а за порцию.")
+BATCH_SYSTEM_PROMPT = (
+    "Ты помощник по питанию. Пользователь присылает пронумерованный список блюд или продуктов, по одному на строке. Для каждой строки ответь только числом — сколько в ней примерно килокалорий. Отвечай строго по одному числу на строку, в том же порядке, без номеров и слов. Если указывается готовая еда или блюдо то стоит считать не за 100грамм, а за порцию.")
 
-YANDEX_API_KEY = None
+# Настройки пула соединений (можно переопределить через окружение)
+GPT_CONN_LIMIT = int(os.environ.get("GPT_CONN_LIMIT", "20"))
+GPT_KEEPALIVE_TIMEOUT = float(os.environ.get("GPT_KEEPALIVE_TIMEOUT", "60"))
+# За сколько секунд до истечения IAM-токена обновлять его в фоне
+IAM_REFRESH_MARGIN = int(os.environ.get("IAM_REFRESH_MARGIN", "600"))
+# IAM-токен живёт до 12 часов, Яндекс рекомендует обновлять его раз в час
+IAM_MAX_TOKEN_AGE = 3600
+IAM_RETRY_DELAY = 30
 
-async def get_iam_token_from_keyfile(path_to_keyfile: str) -> str:
-    try:
-        with open(path_to_keyfile, 'r') as f:
-            key_data = json.load(f)
+# Планировщик запросов к GPT
+GPT_MAX_CONCURRENCY = int(os.environ.get("GPT_MAX_CONCURRENCY", "8"))
+GPT_DEADLINE = float(os.environ.get("GPT_DEADLINE", "15"))          # секунд на весь вызов, включая очередь
+GPT_MAX_RETRIES = int(os.environ.get("GPT_MAX_RETRIES", "3"))
+GPT_BACKOFF_BASE = float(os.environ.get("GPT_BACKOFF_BASE", "0.5"))
+GPT_BACKOFF_MAX = float(os.environ.get("GPT_BACKOFF_MAX", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GPT_BREAKER_FAILURES", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("GPT_BREAKER_RESET", "30"))
 
-        private_key = serialization.load_pem_private_key(
-            key_data["private_key"].encode(),
-            password=None
-        )
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
 
-        payload = {
-            "aud": "https://iam.api.cloud.yandex.net/iam/v1/tokens",
-            "iss": key_data["service_account_id"],
-            "iat": int(time.time()),
-            "exp": int(time.time()) + 360
-        }
 
-        headers = {"kid": key_data["id"]}
-        encoded_jwt = jwt_encode(payload, private_key, algorithm="PS256", headers=headers)
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://iam.api.cloud.yandex.net/iam/v1/tokens",
-                json={"jwt": encoded_jwt}
-            ) as resp:
-                resp.raise_for_status()
-                result = await resp.json()
-                return result["iamToken"]
-    except Exception as e:
-        print(f"Ошибка при загрузке ключа или получении IAM токена: {e}")
-        raise
+class GPTError(Exception):
+    """GPT не дал пригодного ответа."""
 
-async def query_yandex_gpt(prompt: str) -> str:
-    global YANDEX_API_KEY
-    if YANDEX_API_KEY is None:
-        YANDEX_API_KEY = await get_iam_token_from_keyfile(KEY_FILE_PATH)
 
-    headers = {
-        "Authorization": f"Bearer {YANDEX_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "modelUri": f"gpt://{FOLDER_ID}/yandexgpt/latest",
-        "completionOptions": {"stream": False, "temperature": 0.3, "maxTokens": 20},
-        "messages": [
-            {"role": "system", "text": SYSTEM_PROMPT},
-            {"role": "user", "text": prompt}
-        ]
+class GPTUnavailable(GPTError):
+    """Предохранитель разомкнут: GPT сейчас не вызываем."""
+
+
+class _RetryableError(GPTError):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _UpstreamError(GPTError):
+    """Сеть, 429 или 5xx не прошли и после всех повторов — это считается отказом для предохранителя."""
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_progress = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # Пропускаем один пробный запрос
+            if self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_progress = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # Пробный запрос завершился без вердикта (например, ошибка в самом запросе)
+        self._trial_in_progress = False
+
+
+def _build_jwt(path_to_keyfile: str) -> str:
+    with open(path_to_keyfile, 'r') as f:
+        key_data = json.load(f)
+
+    private_key = serialization.load_pem_private_key(
+        key_data["private_key"].encode(),
+        password=None
+    )
+
+    payload = {
+        "aud": YANDEX_IAM_URL,
+        "iss": key_data["service_account_id"],
+        "iat": int(time.time()),
+        "exp": int(time.time()) + 360
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(YANDEX_GPT_URL, headers=headers, json=data) as resp:
+    headers = {"kid": key_data["id"]}
+    return jwt_encode(payload, private_key, algorithm="PS256", headers=headers)
+
+
+async def get_iam_token_from_keyfile(path_to_keyfile: str, session: aiohttp.ClientSession) -> tuple[str, float]:
+    """Обменивает JWT сервисного аккаунта на IAM-токен. Возвращает (токен, время истечения в time.time())."""
+    try:
+        encoded_jwt = _build_jwt(path_to_keyfile)
+
+        async with session.post(YANDEX_IAM_URL, json={"jwt": encoded_jwt}) as resp:
+            resp.raise_for_status()
             result = await resp.json()
-            print(f"Yandex GPT raw response: {result}")  # Лог для отладки
+
+        expires_at = time.time() + IAM_MAX_TOKEN_AGE
+        if "expiresAt" in result:
             try:
-                return result["result"]["alternatives"][0]["message"]["text"].strip()
-            except Exception as e:
-                print(f"Ошибка при разборе ответа: {e}")
-                return "0"
+                # Формат RFC3339 c наносекундами: 2025-01-01T12:00:00.123456789Z
+                raw = result["expiresAt"].rstrip("Z").split(".")[0]
+                server_expiry = datetime.fromisoformat(raw + "+00:00").timestamp()
+                expires_at = min(expires_at, server_expiry)
+            except ValueError:
+                pass
+        return result["iamToken"], expires_at
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке ключа или получении IAM токена: {e}")
+        raise
+
+
+class YandexGPTClient:
+    """Долгоживущий клиент YandexGPT: общий пул соединений и фоновое обновление IAM-токена."""
+
+    def __init__(self, key_file_path: str = KEY_FILE_PATH,
+                 conn_limit: int = GPT_CONN_LIMIT,
+                 keepalive_timeout: float = GPT_KEEPALIVE_TIMEOUT):
+        self._key_file_path = key_file_path
+        self._conn_limit = conn_limit
+        self._keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._semaphore = asyncio.Semaphore(GPT_MAX_CONCURRENCY)
+        self.breaker = CircuitBreaker()
+        self.queued = 0       # ждут свободного слота
+        self.in_flight = 0    # выполняются прямо сейчас
+        self.counters = {"calls": 0, "success": 0, "failures": 0, "retries": 0, "timeouts": 0, "rejected": 0}
+
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(
+            limit=self._conn_limit,
+            limit_per_host=self._conn_limit,
+            keepalive_timeout=self._keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        try:
+            await self._refresh_token()
+        except Exception as e:
+            # Без токена бот всё равно стартует: записи сохранятся с «?», токен возьмут _refresh_loop и _get_token
+            logger.error(f"IAM-токен не получен при старте, повторим позже: {e}")
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _refresh_token(self, stale_token: Optional[str] = None) -> str:
+        async with self._token_lock:
+            # Пока ждали блокировку, токен мог обновить кто-то другой
+            if stale_token is not None and self._token is not None and self._token != stale_token:
+                return self._token
+            self._token, self._token_expires_at = await get_iam_token_from_keyfile(
+                self._key_file_path, self._session
+            )
+            return self._token
+
+    async def _request_token(self, stale_token: Optional[str] = None) -> str:
+        try:
+            return await self._refresh_token(stale_token)
+        except Exception as e:
+            # Нет ключа или IAM недоступен — для вызывающего это отказ сервиса, как 5xx
+            raise _UpstreamError(f"IAM-токен недоступен: {e}") from e
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            delay = max(self._token_expires_at - IAM_REFRESH_MARGIN - time.time(), 0)
+            await asyncio.sleep(delay)
+            try:
+                await self._refresh_token()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Старый токен ещё действует — пробуем позже
+                await asyncio.sleep(IAM_RETRY_DELAY)
+
+    async def _get_token(self) -> str:
+        if self._token is None or time.time() >= self._token_expires_at:
+            # "" вместо None: если токена ещё нет, ожидающие получат тот, что возьмёт первый
+            return await self._request_token(self._token or "")
+        return self._token
+
+    async def _post(self, data: dict) -> dict:
+        token = await self._get_token()
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+            async with self._session.post(YANDEX_GPT_URL, headers=headers, json=data) as resp:
+                if resp.status == 401 and attempt == 0:
+                    # Токен отозван или истёк раньше срока — берём новый и повторяем один раз
+                    token = await self._request_token(token)
+                    continue
+                if resp.status in RETRYABLE_STATUSES:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise _RetryableError(
+                        f"YandexGPT HTTP {resp.status}",
+                        float(retry_after) if retry_after and retry_after.isdigit() else None
+                    )
+                if resp.status != 200:
+                    raise GPTError(f"YandexGPT HTTP {resp.status}: {await resp.text()}")
+                return await resp.json()
+        raise GPTError("YandexGPT: 401 после обновления токена")
+
+    async def _call_with_retries(self, data: dict) -> dict:
+        for attempt in range(GPT_MAX_RETRIES + 1):
+            try:
+                with span("gpt.http", attempt=attempt):
+                    return await self._post(data)
+            except (_RetryableError, aiohttp.ClientError) as e:
+                if attempt == GPT_MAX_RETRIES:
+                    raise _UpstreamError(f"YandexGPT: попытки исчерпаны ({e})") from e
+                # Экспоненциальная задержка с полным джиттером
+                delay = random.uniform(0, min(GPT_BACKOFF_MAX, GPT_BACKOFF_BASE * 2 ** attempt))
+                if isinstance(e, _RetryableError) and e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                self.counters["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def _run(self, data: dict) -> dict:
+        self.queued += 1
+        try:
+            with span("gpt.wait_slot"):
+                await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            return await self._call_with_retries(data)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def complete(self, prompt: str, system_prompt: str = SYSTEM_PROMPT, max_tokens: int = 20) -> str:
+        self.counters["calls"] += 1
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            raise GPTUnavailable("YandexGPT временно недоступен")
+
+        data = {
+            "modelUri": f"gpt://{FOLDER_ID}/yandexgpt/latest",
+            "completionOptions": {"stream": False, "temperature": 0.3, "maxTokens": max_tokens},
+            "messages": [
+                {"role": "system", "text": system_prompt},
+                {"role": "user", "text": prompt}
+            ]
+        }
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span("gpt.complete", chars=len(prompt)):
+                async with asyncio.timeout(GPT_DEADLINE):
+                    result = await self._run(data)
+            outcome = "success"
+        except TimeoutError:
+            outcome = "timeout"
+            self.counters["timeouts"] += 1
+            self.counters["failures"] += 1
+            self.breaker.record_failure()
+            raise GPTError(f"YandexGPT: превышен дедлайн {GPT_DEADLINE} с") from None
+        except _UpstreamError:
+            outcome = "upstream_error"
+            self.counters["failures"] += 1
+            self.breaker.record_failure()
+            raise
+        except GPTError:
+            # Сервис ответил, но запрос отклонён (4xx) — предохранитель тут ни при чём
+            outcome = "client_error"
+            self.counters["failures"] += 1
+            self.breaker.record_success()
+            raise
+        except BaseException:
+            outcome = "cancelled"
+            self.breaker.release()
+            raise
+        finally:
+            GPT_LATENCY.observe(time.perf_counter() - started, outcome)
+
+        self.breaker.record_success()
+        self.counters["success"] += 1
+        try:
+            text = result["result"]["alternatives"][0]["message"]["text"].strip()
+        except (KeyError, IndexError, TypeError) as e:
+            raise GPTError(f"Ошибка при разборе ответа: {e}")
+        log_sampled(
+            logger, "gpt_response",
+            prompt=prompt[:200], text=text[:200],
+            seconds=round(time.perf_counter() - started, 3),
+            usage=result.get("result", {}).get("usage"),
+        )
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "breaker_state": self.breaker.state,
+            **self.counters,
+        }
+
+
+_gpt_client: Optional[YandexGPTClient] = None
+
+async def init_gpt_client():
+    global _gpt_client
+    _gpt_client = YandexGPTClient()
+    await _gpt_client.start()
+    print("✅ YandexGPT client initialized")
+
+def get_gpt_client() -> YandexGPTClient:
+    if _gpt_client is None:
+        raise RuntimeError("YandexGPT client is not initialized. Call init_gpt_client() first.")
+    return _gpt_client
+
+async def close_gpt_client():
+    global _gpt_client
+    if _gpt_client is not None:
+        await _gpt_client.close()
+        _gpt_client = None
+
+def gpt_stats() -> dict:
+    return _gpt_client.stats() if _gpt_client is not None else {}
+
+def _gpt_metrics():
+    if _gpt_client is None:
+        return []
+    return [
+        ("calofit_gpt_events_total", "counter", "Вызовы, ответы, ошибки и ретраи YandexGPT",
+         [({"kind": name}, value) for name, value in _gpt_client.counters.items()]),
+        ("calofit_gpt_queued", "gauge", "Запросы, ждущие семафора", [({}, _gpt_client.queued)]),
+        ("calofit_gpt_in_flight", "gauge", "Запросы к YandexGPT в полёте", [({}, _gpt_client.in_flight)]),
+        ("calofit_gpt_breaker_open", "gauge", "Предохранитель разомкнут (1) или нет (0)",
+         [({}, int(_gpt_client.breaker.state == CircuitBreaker.OPEN))]),
+    ]
+
+register_collector(_gpt_metrics)
+
+async def query_yandex_gpt(prompt: str) -> str:
+    return await get_gpt_client().complete(prompt)
+
+async def query_yandex_gpt_batch(prompts: list[str]) -> list[Optional[int]]:
+    # Один запрос на несколько блюд: в ответе по числу на строку
+    numbered = "\n".join(f"{i}. {p}" for i, p in enumerate(prompts, 1))
+    text = await get_gpt_client().complete(numbered, BATCH_SYSTEM_PROMPT, max_tokens=10 * len(prompts) + 10)
 
+    lines = [line for line in text.splitlines() if re.search(r"\d", line)]
+    if len(lines) != len(prompts):
+        # Модель сбилась с формата — не угадываем, какое число к чему относится, а спрашиваем по одному:
+        # иначе одно непонятное блюдо помечало бы неоцениваемой всю пачку
+        if len(prompts) == 1:
+            return [None]
+        return [(await query_yandex_gpt_batch([prompt]))[0] for prompt in prompts]
+    results = []
+    for line in lines:
+        # Если модель всё же пронумеровала строки, номер отбрасываем
+        numbers = re.findall(r"\d+", re.sub(r"^\s*\d+[.)]\s+", "", line))
+        results.append(int(numbers[0]) if numbers else None)
+    return results
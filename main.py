@@ -2,18 +2,72 @@ import sys
 sys.path.append(".")
 
 import asyncio
+import multiprocessing
 import os
+import signal
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from handlers import report, start_help, delete, log_calories, yandex_gpt, graph, add_cache, edit_cache, from_cache
-from db.database import init_db
+from handlers.yandex_gpt import init_gpt_client, close_gpt_client
+from handlers.reestimate import start_reestimate_worker, stop_reestimate_worker
+from handlers.graph_render import init_graph_pool, close_graph_pool
+from handlers.lifecycle import InFlightMiddleware, SHUTDOWN_TIMEOUT, mark_ready, mark_stopping
+from db.database import SHARED_WORKERS, init_db, close_db, get_db_pool
+from db.calorie_cache import warm_calorie_cache
+from db.migrate import migrate_on_startup
+from db.fsm_storage import PostgresStorage
+from monitoring.log import setup_logging
+from monitoring.metrics import start_metrics_server
+from monitoring.middleware import setup_handler_metrics
+from monitoring.tracing import TRACE_ENABLED, TraceMiddleware, TelegramTraceMiddleware
 
-bot = Bot(token=os.environ["CALOFITBOT_TOKEN"])
-dp = Dispatcher()
+# polling — один процесс с long polling, webhook — aiohttp-сервер с несколькими процессами
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Публичный https-адрес, на который Telegram шлёт обновления, например https://bot.example.com
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+# Telegram присылает его в X-Telegram-Bot-Api-Secret-Token, чужие запросы получают 401
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEB_HOST = os.environ.get("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.environ.get("WEB_PORT", "8080"))
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+HEALTH_DB_TIMEOUT = float(os.environ.get("HEALTH_DB_TIMEOUT", "2"))
+# postgres — диалоги переживают рестарт и видны всем воркерам, memory — как раньше, в памяти процесса
+FSM_STORAGE = os.environ.get("FSM_STORAGE", "postgres")
+# 1 — применять новые миграции при старте; иначе перед выкаткой: python -m db.migrate
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "0") == "1"
 
-async def main():
-    await init_db()
+# Обновления, которые сейчас обрабатываются в этом процессе, — их дожидаемся при остановке
+in_flight = InFlightMiddleware()
+
+
+def create_bot() -> Bot:
+    bot = Bot(token=os.environ["CALOFITBOT_TOKEN"])
+    if TRACE_ENABLED:
+        bot.session.middleware(TelegramTraceMiddleware())
+    return bot
 
+def create_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "postgres":
+        # Обновления одного пользователя могут попасть в разные воркеры — тогда кэш в памяти отключаем
+        cache_ttl = float(os.environ.get("FSM_CACHE_TTL", "0" if SHARED_WORKERS else "600"))
+        return PostgresStorage(cache_ttl=cache_ttl)
+    raise RuntimeError(f"Unknown FSM_STORAGE: {FSM_STORAGE}")
+
+def create_dispatcher() -> Dispatcher:
+    # Роутеры подключаются к диспетчеру один раз на процесс
+    dp = Dispatcher(storage=create_storage())
+    dp.update.outer_middleware(in_flight)
+    setup_handler_metrics(dp)
+    if TRACE_ENABLED:
+        # После метрик: к концу обновления метки обработчика уже известны
+        dp.update.outer_middleware(TraceMiddleware())
     dp.include_router(start_help.router)
     dp.include_router(add_cache.router)
     dp.include_router(edit_cache.router)
@@ -22,8 +76,171 @@ async def main():
     dp.include_router(delete.router)
     dp.include_router(graph.router)
     dp.include_router(log_calories.router)
+    return dp
+
+async def startup(run_background: bool):
+    if MIGRATE_ON_STARTUP:
+        # Воркеры webhook стартуют одновременно: миграции применит первый, остальные подождут блокировку
+        await migrate_on_startup()
+    await init_db()
+    await warm_calorie_cache()
+    await init_gpt_client()
+    await init_graph_pool()
+    # Фоновую дооценку запускаем в одном процессе, иначе воркеры будут делить одни и те же записи
+    return start_reestimate_worker() if run_background else None
+
+async def drain(reestimate_task) -> None:
+    # Новые обновления уже не приходят: ждём начатые обработчики и текущий проход дооценки
+    waits = [in_flight.drain(SHUTDOWN_TIMEOUT)]
+    if reestimate_task:
+        waits.append(stop_reestimate_worker(reestimate_task, SHUTDOWN_TIMEOUT))
+    await asyncio.gather(*waits)
+
+async def close_resources(metrics_runner=None) -> None:
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await close_gpt_client()
+    close_graph_pool()
+    await close_db()
+
+async def run_polling() -> None:
+    bot = create_bot()
+    dp = create_dispatcher()
+    reestimate_task = await startup(run_background=True)
+    metrics_runner = await start_metrics_server()
+    try:
+        # Если до этого работали через webhook, getUpdates без этого вернёт конфликт
+        await bot.delete_webhook()
+        mark_ready()
+        # По SIGTERM/SIGINT aiogram перестаёт забирать обновления и возвращается сюда;
+        # сессию бота не закрываем, пока обработчики не допишут ответы
+        await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        mark_stopping()
+        await drain(reestimate_task)
+        await bot.session.close()
+        await close_resources(metrics_runner)
+
+async def healthz(request: web.Request) -> web.Response:
+    worker = request.app["worker_index"]
+    try:
+        async with asyncio.timeout(HEALTH_DB_TIMEOUT):
+            async with get_db_pool().acquire() as conn:
+                await conn.fetchval("SELECT 1")
+    except Exception as e:
+        return web.json_response({"status": "db_unavailable", "worker": worker, "error": str(e)}, status=503)
+    return web.json_response({"status": "ok", "worker": worker})
+
+async def run_webhook_worker(worker_index: int, ready=None) -> None:
+    bot = create_bot()
+    dp = create_dispatcher()
+    reestimate_task = await startup(run_background=worker_index == 0)
+    if WEB_WORKERS <= 1:
+        await set_webhook(bot, dp)
+    # У каждого воркера свой /metrics на METRICS_PORT + номер воркера
+    metrics_runner = await start_metrics_server(worker_index)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    app = web.Application()
+    app["worker_index"] = worker_index
+    app.router.add_get("/healthz", healthz)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # reuse_port: все процессы слушают один порт, ядро раскладывает соединения между ними,
+    # в том числе воркеры старого и нового экземпляра при перезапуске с перекрытием
+    site = web.TCPSite(runner, WEB_HOST, WEB_PORT, reuse_port=True)
+    await site.start()
+    print(f"✅ Webhook worker {worker_index} listening on {WEB_HOST}:{WEB_PORT}{WEBHOOK_PATH}")
+    if ready is not None:
+        ready.set()
+    else:
+        mark_ready()
+
+    try:
+        await stop.wait()
+    finally:
+        if ready is None:
+            mark_stopping()
+        # Перестаём принимать соединения; Telegram повторит недоставленное в другой воркер или новому процессу
+        await site.stop()
+        await drain(reestimate_task)
+        # Закрывает и сессию бота (SimpleRequestHandler.close)
+        await runner.cleanup()
+        await close_resources(metrics_runner)
+
+async def set_webhook(bot: Bot, dp: Dispatcher) -> None:
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required in webhook mode")
+    await bot.set_webhook(
+        f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    print(f"✅ Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+async def register_webhook() -> None:
+    # Роутеры можно подключить только к одному диспетчеру, поэтому здесь он свой, а воркеры — отдельные процессы
+    bot = create_bot()
+    try:
+        await set_webhook(bot, create_dispatcher())
+    finally:
+        await bot.session.close()
+
+def _worker_main(worker_index: int, ready=None) -> None:
+    setup_logging()
+    asyncio.run(run_webhook_worker(worker_index, ready))
+
+def run_webhook() -> None:
+    if WEB_WORKERS <= 1:
+        _worker_main(0)
+        return
+
+    # Webhook регистрирует только родительский процесс, воркеры лишь принимают обновления
+    asyncio.run(register_webhook())
+    # spawn: каждый воркер импортирует модули заново, со своими пулами, кэшами и роутерами
+    ctx = multiprocessing.get_context("spawn")
+    ready = [ctx.Event() for _ in range(WEB_WORKERS)]
+    workers = [
+        ctx.Process(target=_worker_main, args=(i, ready[i]), name=f"calofitbot-web-{i}")
+        for i in range(WEB_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def stop_workers(signum, frame):
+        # Воркеры получают SIGTERM и сами дорабатывают начатые обновления
+        mark_stopping()
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    # Готовы, когда прогрелись и слушают порт все воркеры
+    for event, worker in zip(ready, workers):
+        while not event.wait(1):
+            if not worker.is_alive():
+                break
+    if all(event.is_set() for event in ready):
+        mark_ready()
+    for worker in workers:
+        worker.join()
 
-    await dp.start_polling(bot)
+def main() -> None:
+    setup_logging()
+    if BOT_MODE == "webhook":
+        run_webhook()
+    elif BOT_MODE == "polling":
+        asyncio.run(run_polling())
+    else:
+        raise RuntimeError(f"Unknown BOT_MODE: {BOT_MODE}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,23 @@
+# monitoring/log.py
+# Отладочные события пишем выборочно и одной JSON-строкой, а не каждое через print
+import json
+import logging
+import os
+import random
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Доля событий log_sampled, попадающих в журнал: 1 — все, 0 — ни одного
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+
+def setup_logging() -> None:
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+def log_sampled(logger: logging.Logger, event: str, rate: float = LOG_SAMPLE_RATE, **fields) -> None:
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return
+    logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
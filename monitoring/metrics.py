@@ -0,0 +1,146 @@
+# monitoring/metrics.py
+# Метрики в текстовом формате Prometheus: счётчики и гистограммы в памяти процесса + /metrics
+import bisect
+import os
+from typing import Callable, Iterable, Optional
+
+from aiohttp import web
+
+# Порт /metrics; у webhook-воркера N — METRICS_PORT + N, пустое значение отключает сервер
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.environ.get("METRICS_PORT", "9101")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+# Функции, которые при каждом запросе /metrics отдают (имя, тип, справка, [(метки, значение)])
+_collectors: list[Callable[[], Iterable[tuple]]] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def snapshot(self) -> dict[tuple, float]:
+        return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._values: dict[tuple, list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        item = self._values.get(labels)
+        if item is None:
+            item = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{plain} {total}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+def register_collector(collector: Callable[[], Iterable[tuple]]) -> None:
+    # Для значений, которые уже считаются в модулях (stats-словари, размер пула): читаем их при скрейпе
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, help_text, samples in collector():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        body=render_metrics().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def start_metrics_server(worker_index: int = 0) -> Optional[web.AppRunner]:
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = int(METRICS_PORT) + worker_index
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    print(f"✅ Metrics on http://{METRICS_HOST}:{port}/metrics")
+    return runner
+
+
+HANDLER_LATENCY = Histogram(
+    "calofit_handler_seconds", "Время обработки обновления", ("router", "handler")
+)
+HANDLER_ERRORS = Counter(
+    "calofit_handler_errors_total", "Необработанные исключения в обработчиках", ("router", "handler")
+)
+DB_ACQUIRE_WAIT = Histogram(
+    "calofit_db_pool_acquire_seconds", "Ожидание свободного соединения из пула",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+DB_QUERIES = Counter(
+    "calofit_db_queries_total", "Запросы к базе через пул", ("result",)
+)
+DB_QUERY_CALLS = Counter(
+    "calofit_db_query_calls_total", "Вызовы именованных запросов из db/queries.py", ("query",)
+)
+HANDLER_QUERIES = Histogram(
+    "calofit_handler_db_queries", "Именованных запросов к базе за одно обновление", ("router", "handler"),
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 20)
+)
+GPT_LATENCY = Histogram(
+    "calofit_gpt_request_seconds", "Запросы к YandexGPT, включая ретраи и очередь", ("outcome",)
+)
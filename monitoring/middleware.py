@@ -0,0 +1,81 @@
+# monitoring/middleware.py
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from monitoring.metrics import HANDLER_LATENCY, HANDLER_ERRORS, HANDLER_QUERIES, DB_QUERY_CALLS
+
+# Какой обработчик выбрал роутер: внешний middleware ещё не знает, внутренний записывает сюда
+_handler_labels: ContextVar[Optional[list]] = ContextVar("handler_labels", default=None)
+# Счётчик запросов текущего обновления; список, чтобы его видели и задачи из gather
+_update_queries: ContextVar[Optional[list]] = ContextVar("update_queries", default=None)
+
+
+def current_handler_labels() -> Optional[tuple]:
+    # (роутер, обработчик) обновления, которое сейчас обрабатывается
+    labels = _handler_labels.get()
+    return tuple(labels) if labels is not None else None
+
+
+def count_query(name: str) -> None:
+    DB_QUERY_CALLS.inc(name)
+    counter = _update_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на update: время обработки обновления с метками роутера и обработчика."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = ["none", "unhandled"]
+        queries = [0]
+        token = _handler_labels.set(labels)
+        queries_token = _update_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(*labels)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, *labels)
+            HANDLER_QUERIES.observe(queries[0], *labels)
+            _update_queries.reset(queries_token)
+            _handler_labels.reset(token)
+
+
+class HandlerLabelMiddleware(BaseMiddleware):
+    """Внутренний middleware: срабатывает после фильтров, когда обработчик уже известен."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = _handler_labels.get()
+        handler_object = data.get("handler")
+        if labels is not None and handler_object is not None:
+            callback = handler_object.callback
+            # handlers.report -> report: роутеры у нас по одному на модуль
+            labels[0] = callback.__module__.rsplit(".", 1)[-1]
+            labels[1] = getattr(callback, "__name__", repr(callback))
+        return await handler(event, data)
+
+
+def setup_handler_metrics(dp: Dispatcher) -> None:
+    dp.update.outer_middleware(HandlerMetricsMiddleware())
+    label_middleware = HandlerLabelMiddleware()
+    # Внутренние middleware диспетчера наследуются всеми подключёнными роутерами
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(label_middleware)
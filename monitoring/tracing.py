@@ -0,0 +1,119 @@
+# monitoring/tracing.py
+# Трассировка медленных обновлений: дерево интервалов (БД, GPT, Telegram) на одно обновление.
+# Выключена по умолчанию; пока корневого интервала нет, span() — это одно чтение contextvar.
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+from monitoring.middleware import current_handler_labels
+
+TRACE_ENABLED = os.environ.get("TRACE_SLOW_UPDATES", "0") == "1"
+# Обновления дольше стольких секунд попадают в журнал вместе с деревом интервалов
+TRACE_THRESHOLD = float(os.environ.get("TRACE_THRESHOLD", "2"))
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "started", "finished", "children")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.finished = None
+        self.children = []
+
+    def to_dict(self, origin: float) -> dict:
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        item = {
+            "name": self.name,
+            "at_ms": round((self.started - origin) * 1000, 1),
+            "ms": round((finished - self.started) * 1000, 1),
+        }
+        if self.attrs:
+            item["attrs"] = self.attrs
+        if self.children:
+            item["children"] = [child.to_dict(origin) for child in self.children]
+        return item
+
+
+class span:
+    """with span("gpt.complete"): ... — дочерний интервал текущего, если обновление трассируется."""
+
+    __slots__ = ("_name", "_attrs", "_span", "_token")
+
+    def __init__(self, name: str, **attrs):
+        self._name = name
+        self._attrs = attrs
+        self._span = None
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is not None:
+            self._span = Span(self._name, self._attrs)
+            # Параллельные задачи (gather) копируют контекст и дописывают в общий список родителя
+            parent.children.append(self._span)
+            self._token = _current.set(self._span)
+        return self
+
+    def set(self, **attrs) -> None:
+        if self._span is not None:
+            self._span.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            self._span.finished = time.perf_counter()
+            if exc_type is not None:
+                self._span.attrs["error"] = exc_type.__name__
+            _current.reset(self._token)
+        return False
+
+
+def is_tracing() -> bool:
+    return _current.get() is not None
+
+
+class TraceMiddleware(BaseMiddleware):
+    """Внешний middleware на update: корневой интервал и запись в журнал, если обновление медленное."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        root = Span("update", {"update_id": getattr(event, "update_id", None)})
+        token = _current.set(root)
+        try:
+            return await handler(event, data)
+        finally:
+            root.finished = time.perf_counter()
+            _current.reset(token)
+            elapsed = root.finished - root.started
+            if elapsed >= TRACE_THRESHOLD:
+                # Метки ставит HandlerMetricsMiddleware, он снаружи этого middleware
+                labels = current_handler_labels()
+                if labels:
+                    root.attrs["router"], root.attrs["handler"] = labels
+                logger.warning(json.dumps(
+                    {"event": "slow_update", "seconds": round(elapsed, 3), "trace": root.to_dict(root.started)},
+                    ensure_ascii=False, default=str
+                ))
+
+
+class TelegramTraceMiddleware(BaseRequestMiddleware):
+    """Интервал на каждый вызов Bot API (answer, reply, send_photo ...)."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"tg.{type(method).__name__}"):
+            return await make_request(bot, method)
@@ -2,7 +2,21 @@
 
 #17 */4 * * * sh  /usr/bin/bash ~/calofitbot/restart_calofitbot.sh
 
-SERVICE_NAME="calofitbot.service"
+# Бот работает одним из двух экземпляров шаблонного юнита calofitbot@.service: a или b.
+# Перезапуск с перекрытием: поднимаем второй экземпляр, ждём его готовности, только потом гасим старый.
+SERVICE_NAME="calofitbot"
 
-if systemctl is-active --quiet "$SERVICE_NAME"; then sudo /usr/bin/systemctl restart "$SERVICE_NAME"; else exit 0; fi
+if systemctl is-active --quiet "$SERVICE_NAME@a.service"; then OLD=a; NEW=b
+elif systemctl is-active --quiet "$SERVICE_NAME@b.service"; then OLD=b; NEW=a
+else exit 0; fi
 
+# С Type=notify start возвращается, только когда новый процесс прогрелся и прислал READY=1
+# (или с ошибкой по TimeoutStartSec) — до этого обновления обрабатывает старый
+if ! sudo /usr/bin/systemctl start "$SERVICE_NAME@$NEW.service"; then
+    echo "❌ $SERVICE_NAME@$NEW did not become ready, $SERVICE_NAME@$OLD keeps running"
+    sudo /usr/bin/systemctl stop "$SERVICE_NAME@$NEW.service"
+    exit 1
+fi
+
+# Остановка мягкая: по SIGTERM бот перестаёт забирать обновления и дожидается начатых (SHUTDOWN_TIMEOUT)
+sudo /usr/bin/systemctl stop "$SERVICE_NAME@$OLD.service"
@@ -0,0 +1,114 @@
+import random
+import time
+
+from db.fuzzy_index import FuzzyIndex, fuzzy_key, is_typo, typo_distance
+from db.normalize import normalize_input
+
+
+def make_index(entries: dict, maxsize=None) -> FuzzyIndex:
+    index = FuzzyIndex(maxsize)
+    for text, calories in entries.items():
+        index.add(normalize_input(text), calories)
+    return index
+
+
+def lookup(index: FuzzyIndex, text: str):
+    return index.lookup(normalize_input(text))
+
+
+def test_word_order_does_not_matter():
+    assert fuzzy_key("овсянка на молоке с бананом") == fuzzy_key("с бананом овсянка на молоке")
+
+
+def test_negation_is_part_of_key():
+    assert fuzzy_key("кофе с сахаром") != fuzzy_key("кофе без сахара")
+    assert fuzzy_key("кофе со сливками") == fuzzy_key("кофе с сливками")
+
+
+def test_negation_never_matches_opposite_dish():
+    index = make_index({"кофе с сахаром": 60, "чай с сахаром": 40, "суп с курицей": 200})
+    assert lookup(index, "кофе без сахара") is None
+    assert lookup(index, "чай без сахара") is None
+    assert lookup(index, "суп без курицы") is None
+
+
+def test_modifier_must_match_exactly():
+    index = make_index({"кофе без сахара": 5})
+    assert lookup(index, "кофе с сахаром") is None
+    assert lookup(index, "сахар кофе") is None
+
+
+def test_different_first_letter_is_not_a_typo():
+    index = make_index({"картофель жареный": 300})
+    assert lookup(index, "картофель вареный") is None
+
+
+def test_typos_in_single_words_match():
+    index = make_index({"картофель жареный": 300, "гречка с курицей": 250})
+    assert lookup(index, "картофель жаренный") == 300
+    assert lookup(index, "картофель жраеный") == 300
+    assert lookup(index, "гречка с курецей") == 250
+
+
+def test_extra_or_missing_word_does_not_match():
+    index = make_index({"кофе с сахаром": 60})
+    assert lookup(index, "кофе с сахаром и молоком") is None
+    assert lookup(index, "кофе") is None
+
+
+def test_numbers_must_match_exactly():
+    index = make_index({"творог 5": 120})
+    assert lookup(index, "творог 9") is None
+    assert lookup(index, "творог 5") == 120
+
+
+def test_short_words_need_exact_match():
+    assert not is_typo("сыр", "сор")
+    assert is_typo("курица", "курыца")
+    assert not is_typo("с+сахар", "без+сахар")
+
+
+def test_typo_distance_counts_typo_tokens():
+    assert typo_distance(["гречк", "с+курец"], ["гречк", "с+куриц"]) == 1
+    assert typo_distance(["гречк"], ["гречк", "с+куриц"]) is None
+
+
+def test_maxsize_evicts_least_recently_used():
+    index = make_index({"борщ красный": 1, "гречка рассыпчатая": 2}, maxsize=2)
+    assert lookup(index, "борщ красный") == 1
+    index.add(normalize_input("плов узбекский"), 3)
+    assert len(index) == 2
+    assert lookup(index, "гречка рассыпчатая") is None
+    assert lookup(index, "борщ красный") == 1
+    assert lookup(index, "плов узбекскый") == 3
+
+
+def test_lookup_stays_fast_on_large_index():
+    # Поиск идёт прямо на event loop: промах по 50k записям не должен занимать больше нескольких мс
+    rng = random.Random(1)
+    letters = "абвгдежзиклмнопрстуфхцчшщыэюя"
+    vocab = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(3000)]
+    dishes = ["курица", "гречка", "молоко", "сахар", "салат", "суп", "кофе", "чай", "картофель", "жареный"]
+    index = FuzzyIndex(50000)
+    while len(index) < 50000:
+        words = [rng.choice(dishes)] + [rng.choice(vocab) for _ in range(rng.randint(0, 3))]
+        if rng.random() < 0.3:
+            words.insert(1, rng.choice(["с", "без"]))
+        index.add(" ".join(words), 100)
+    queries = [" ".join(rng.sample(dishes, 2) + [rng.choice(vocab)]) for _ in range(100)]
+    queries += ["курица с гречкой", "кофе с молоком и сахаром", "картофель жареный с курицей"]
+    index.add(normalize_input("картофель жареный с курицей"), 350)
+    # Ограничение кандидатов не мешает находить опечатки
+    assert lookup(index, "картофель жаренный с курицей") == 350
+    assert lookup(index, "картофель жареный с курецей") == 350
+
+    for query in queries:
+        # Лучшее из трёх: единичная пауза сборщика мусора не должна ронять тест
+        best = min(_timed_lookup(index, query) for _ in range(3))
+        assert best < 0.005, f"{query!r}: {best * 1000:.1f} ms"
+
+
+def _timed_lookup(index: FuzzyIndex, query: str) -> float:
+    started = time.perf_counter()
+    index.lookup(query)
+    return time.perf_counter() - started
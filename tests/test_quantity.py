@@ -0,0 +1,54 @@
+from handlers.quantity import Quantity, parse_quantity
+
+
+def test_unit_at_end():
+    assert parse_quantity("гречка 250 г") == Quantity("гречка", 250, "г")
+    assert parse_quantity("молоко 0,5 л") == Quantity("молоко", 500, "мл")
+    assert parse_quantity("хлеб50г") == Quantity("хлеб", 50, "г")
+
+
+def test_amount_at_start():
+    assert parse_quantity("2 яйца") == Quantity("яйца", 2, "шт")
+    assert parse_quantity("1.5 кг картошки") == Quantity("картошки", 1500, "г")
+
+
+def test_bare_number_needs_whitespace():
+    assert parse_quantity("яйца 2") == Quantity("яйца", 2, "шт")
+    assert parse_quantity("витамин b12 2") is None
+    assert parse_quantity("гречка 250") == Quantity("гречка", 250, "г")
+    assert parse_quantity("витамин b12") is None
+    assert parse_quantity("витамин b12 2 шт") == Quantity("витамин b12", 2, "шт")
+
+
+def test_fractional_bare_number_is_part_of_name():
+    assert parse_quantity("молоко 3.2") is None
+    assert parse_quantity("кефир 2,5") is None
+    assert parse_quantity("3.2 молоко") is None
+    assert parse_quantity("молоко 3.2 200 мл") == Quantity("молоко 3.2", 200, "мл")
+
+
+def test_no_quantity():
+    assert parse_quantity("борщ") is None
+    assert parse_quantity("гречка 0 г") is None
+
+
+def test_scale_from_base_portion():
+    quantity = parse_quantity("гречка 250 г")
+    assert quantity.base_text == "гречка 100 г"
+    assert quantity.scale(110) == 275
+
+
+def test_small_bare_number_is_pieces_only_for_countable_food():
+    assert parse_quantity("сахар 10") is None
+    assert parse_quantity("сыр 15") is None
+    assert parse_quantity("10 сахар") is None
+    assert parse_quantity("сливки 10") is None
+    assert parse_quantity("салат с яйцом 2") is None
+    assert parse_quantity("куриные яйца 3") == Quantity("куриные яйца", 3, "шт")
+    assert parse_quantity("котлеты 2") == Quantity("котлеты", 2, "шт")
+    assert parse_quantity("3 блина") == Quantity("блина", 3, "шт")
+
+
+def test_piece_word_makes_any_food_countable():
+    assert parse_quantity("сыр 2 шт") == Quantity("сыр", 2, "шт")
+    assert parse_quantity("сыр 15 г") == Quantity("сыр", 15, "г")
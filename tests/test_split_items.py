@@ -0,0 +1,30 @@
+from handlers.quantity import split_items
+
+
+def test_separators():
+    assert split_items("борщ, хлеб; компот") == ["борщ", "хлеб", "компот"]
+    assert split_items("кофе + круассан\nсок") == ["кофе", "круассан", "сок"]
+    assert split_items(" борщ ,, хлеб ") == ["борщ", "хлеб"]
+
+
+def test_decimal_comma_is_not_a_separator():
+    assert split_items("молоко 0,5 л, хлеб") == ["молоко 0,5 л", "хлеб"]
+
+
+def test_commas_inside_brackets_are_kept():
+    assert split_items("салат (огурцы, помидоры)") == ["салат (огурцы, помидоры)"]
+    assert split_items("салат (огурцы, помидоры), хлеб") == ["салат (огурцы, помидоры)", "хлеб"]
+    assert split_items("боул [рис; лосось], чай") == ["боул [рис; лосось]", "чай"]
+
+
+def test_unbalanced_bracket_does_not_block_splitting():
+    assert split_items("суп), хлеб") == ["суп)", "хлеб"]
+
+
+def test_quantity_fragment_stays_with_its_food():
+    assert split_items("яйцо,2 шт") == ["яйцо 2 шт"]
+    assert split_items("гречка, 200 г, курица") == ["гречка 200 г", "курица"]
+
+
+def test_bare_number_is_a_separate_calorie_entry():
+    assert split_items("борщ, 300") == ["борщ", "300"]